@@ -1,23 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from transcribation_service import transcribe_audio
-from dyarise_service import diarize_audio
+from dyarise_service import diarize_audio, SpeakerTimeline
+from audio_service import decode_audio
+from model_manager import ModelManager
 
 
 def get_speaker_at_time(time, diarization):
     """Определяет спикера в заданное время"""
-    for start, end, speaker in diarization:
-        if start <= time < end:
-            return speaker
-    return "Speaker_Unknown"
+    return SpeakerTimeline.from_segments(diarization).speaker_at(time)
 
 
-def merge_transcription_diarization(audio_path, n_speakers=2, progress_callback=None):
-    """Объединяет транскрибацию и диаризацию"""
+def build_dialogue(transcription, diarization):
+    """Собирает диалог из слов транскрибации и интервалов спикеров"""
+    diarization = SpeakerTimeline.from_segments(diarization)
     
+    words = []
+    times = []
+    for result in transcription:
+        for word_info in result.get("result", []):
+            words.append(word_info["word"])
+            times.append(word_info["start"])
+    
+    # Все слова сопоставляются со спикерами одним векторным вызовом
+    speakers = diarization.speakers_at(times)
+    
+    dialogue = []
+    current_speaker = None
+    current_text = []
+    for word, speaker in zip(words, speakers):
+        if speaker != current_speaker:
+            if current_text:
+                dialogue.append((current_speaker, " ".join(current_text)))
+            current_speaker = speaker
+            current_text = [word]
+        else:
+            current_text.append(word)
+    
+    if current_text:
+        dialogue.append((current_speaker, " ".join(current_text)))
+    
+    return dialogue
+
+
+def _run_stages_sequential(audio_path, audio, n_speakers, progress_callback, workers, feature_cache=None,
+                           n_jobs=None, cancel_check=None, use_change_points=False):
+    """Транскрибация и диаризация друг за другом"""
     # Этап 1: Транскрибация
     if progress_callback:
         progress_callback("Транскрибация", 0.2, "Запуск распознавания речи...")
     
-    transcription = transcribe_audio(audio_path)
+    transcription = transcribe_audio(audio_path, audio=audio, workers=workers, cancel_check=cancel_check)
     
     if progress_callback:
         progress_callback("Транскрибация", 0.4, "Распознавание завершено")
@@ -26,49 +58,146 @@ def merge_transcription_diarization(audio_path, n_speakers=2, progress_callback=
     if progress_callback:
         progress_callback("Диаризация", 0.5, "Определение спикеров...")
     
-    diarization = diarize_audio(audio_path, n_speakers)
+    diarization = diarize_audio(audio_path, n_speakers, audio=audio, feature_cache=feature_cache, n_jobs=n_jobs,
+                                cancel_check=cancel_check, use_change_points=use_change_points)
     
     if progress_callback:
         progress_callback("Диаризация", 0.7, "Спикеры определены")
     
-    # Этап 3: Объединение
+    return transcription, diarization
+
+
+def _run_stages_parallel(audio_path, audio, n_speakers, progress_callback, workers, feature_cache=None,
+                         n_jobs=None, cancel_check=None, use_change_points=False):
+    """Транскрибация и диаризация одновременно в пуле потоков"""
+    # Vosk, numpy и sklearn отпускают GIL в тяжелых участках,
+    # поэтому потоки работают параллельно и делят один буфер аудио
     if progress_callback:
-        progress_callback("Объединение", 0.75, "Формирование диалога...")
+        progress_callback("Транскрибация", 0.2, "Распознавание речи и определение спикеров...")
     
-    dialogue = []
-    current_speaker = None
-    current_text = []
+    executor = ThreadPoolExecutor(max_workers=2)
+    transcription_future = executor.submit(transcribe_audio, audio_path, audio=audio, workers=workers,
+                                           cancel_check=cancel_check)
+    diarization_future = executor.submit(diarize_audio, audio_path, n_speakers, audio=audio,
+                                         feature_cache=feature_cache, n_jobs=n_jobs, cancel_check=cancel_check,
+                                         use_change_points=use_change_points)
+    futures = {
+        transcription_future: ("Транскрибация", "Распознавание завершено"),
+        diarization_future: ("Диаризация", "Спикеры определены"),
+    }
     
-    total_results = len(transcription)
-    for idx, result in enumerate(transcription):
-        if "result" in result:
-            for word_info in result["result"]:
-                word = word_info["word"]
-                time = word_info["start"]
-                speaker = get_speaker_at_time(time, diarization)
-                
-                if speaker != current_speaker:
-                    if current_text:
-                        dialogue.append((current_speaker, " ".join(current_text)))
-                    current_speaker = speaker
-                    current_text = [word]
-                else:
-                    current_text.append(word)
-        
-        # Обновляем прогресс объединения
-        if progress_callback and total_results > 0:
-            progress = 0.75 + 0.2 * (idx + 1) / total_results
-            progress_callback("Объединение", progress, f"Обработано {idx+1} из {total_results} сегментов")
+    progress = 0.2
+    try:
+        for future in as_completed(futures):
+            # Ошибка или отмена любого этапа прерывает анализ
+            future.result()
+            stage, message = futures[future]
+            progress += 0.25
+            if progress_callback:
+                progress_callback(stage, progress, message)
+    except BaseException:
+        # Второй этап не дожидаемся: при отмене он остановится на ближайшей проверке сам
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
     
-    if current_text:
-        dialogue.append((current_speaker, " ".join(current_text)))
+    return transcription_future.result(), diarization_future.result()
+
+
+def load_cached_analysis(audio_path, n_speakers, cache, use_change_points=False):
+    """Диалог и диаризация из кэша или None"""
+    payload = cache.get_analysis(audio_path, ModelManager().get_model_path(), n_speakers, use_change_points)
+    if payload is None:
+        return None
+    dialogue = [tuple(turn) for turn in payload["dialogue"]]
+    return dialogue, SpeakerTimeline.from_dict(payload["diarization"])
+
+
+def merge_transcription_diarization(audio_path, n_speakers=2, progress_callback=None, parallel=False, workers=1,
+                                    cache=None, diarization=None, n_jobs=None, cancel_check=None,
+                                    use_change_points=False):
+    """Объединяет транскрибацию и диаризацию.
+    
+    parallel - этапы выполняются одновременно,
+    workers - число процессов для транскрибации по кускам,
+    cache - AnalysisCache для повторного использования результатов,
+    diarization - готовая диаризация (например, полученная во время записи),
+    тогда выполняется только транскрибация,
+    n_jobs - процессов для оценки числа спикеров ('auto'),
+    cancel_check - вызывается внутри этапов и выбрасывает исключение при отмене,
+    use_change_points - сегментация по BIC перед кластеризацией (см. diarize_audio).
+    """
+    model_path = ModelManager().get_model_path()
+    live_diarization = diarization is not None
+    
+    transcription = None
+    if cache is not None:
+        cached = None if live_diarization else load_cached_analysis(audio_path, n_speakers, cache, use_change_points)
+        if cached is not None:
+            if progress_callback:
+                progress_callback("Объединение", 0.95, "Результат загружен из кэша")
+            return cached
+        transcription = cache.get_transcription(audio_path, model_path)
+    
+    feature_cache = cache.features if cache is not None else None
+    pcm_cache = cache.pcm if cache is not None else None
+    
+    if transcription is None:
+        if live_diarization:
+            # Нужна только транскрибация - файл декодируется потоково, без полного буфера
+            if progress_callback:
+                progress_callback("Транскрибация", 0.2, "Спикеры определены при записи, распознавание речи...")
+            transcription = transcribe_audio(audio_path, workers=workers, pcm_cache=pcm_cache,
+                                             cancel_check=cancel_check)
+        else:
+            # Этап 0: Декодирование (один раз для обоих этапов)
+            if progress_callback:
+                progress_callback("Загрузка", 0.15, "Декодирование аудио...")
+            
+            audio = decode_audio(audio_path, pcm_cache=pcm_cache)
+            run_stages = _run_stages_parallel if parallel else _run_stages_sequential
+            transcription, diarization = run_stages(audio_path, audio, n_speakers, progress_callback, workers,
+                                                    feature_cache, n_jobs, cancel_check, use_change_points)
+            del audio  # Буфер больше не нужен на этапе объединения
+        if cache is not None:
+            cache.put_transcription(audio_path, model_path, transcription)
+    elif not live_diarization:
+        # Транскрибация из кэша - заново обучается только GMM,
+        # аудио декодируется лишь при отсутствии признаков в кэше
+        if progress_callback:
+            progress_callback("Диаризация", 0.5, "Транскрибация из кэша, определение спикеров...")
+        diarization = diarize_audio(audio_path, n_speakers, feature_cache=feature_cache, pcm_cache=pcm_cache,
+                                    n_jobs=n_jobs, cancel_check=cancel_check, use_change_points=use_change_points)
+        if progress_callback:
+            progress_callback("Диаризация", 0.7, "Спикеры определены")
+    
+    # Этап 3: Объединение
+    if progress_callback:
+        progress_callback("Объединение", 0.75, "Формирование диалога...")
+    
+    diarization = SpeakerTimeline.from_segments(diarization)
+    dialogue = build_dialogue(transcription, diarization)
     
     if progress_callback:
         progress_callback("Объединение", 0.95, "Финализация результатов...")
     
+    if cache is not None and not live_diarization:
+        cache.put_analysis(audio_path, model_path, n_speakers, dialogue, diarization.to_dict(), use_change_points)
+    
     return dialogue, diarization
 
 
+def merge_recorded_segments(transcription, diarization):
+    """Диалог из сегментов, распознанных во время записи, и онлайн-диаризации.
+    
+    Полный проход по файлу не нужен. Транскрибация в кэш не сохраняется:
+    она получена только по фрагментам, отобранным VAD, и не заменяет
+    транскрибацию всего файла при повторном анализе.
+    """
+    diarization = SpeakerTimeline.from_segments(diarization)
+    return build_dialogue(transcription, diarization), diarization
+
+
 if __name__ == "__main__":
     dialogue, diarization = merge_transcription_diarization("examples/e2.mp3", n_speakers=2)
     
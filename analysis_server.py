@@ -0,0 +1,276 @@
+"""Локальный сервер анализа: модели загружаются один раз и обслуживают всех клиентов.
+
+POST /analyze - анализ файла: JSON {"path": ..., "n_speakers": 2 | "auto"}
+    или multipart с полем file (и необязательным n_speakers).
+GET /stream - WebSocket: клиент шлет бинарные кадры PCM int16 моно
+    (частота в параметре sample_rate, по умолчанию 16000; model=small - малая модель),
+    сервер отвечает {"type": "partial"} и {"type": "result"}. Текстовое сообщение "end"
+    завершает поток, в ответ приходит {"type": "final"} с диалогом, диаризацией и статистикой.
+GET /health - состояние моделей.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from aiohttp import web, WSMsgType
+from cache_service import AnalysisCache, CACHE_DIR
+from job_queue_service import AnalysisJobQueue, JOB_DONE, JOB_FAILED, JOB_CANCELLED
+from model_manager import ModelManager, SMALL_MODEL_PATH, default_workers
+from statistics_service import calculate_statistics
+
+# Загруженные файлы; остатки после аварийного завершения удаляются при запуске
+UPLOAD_DIR = os.path.join(CACHE_DIR, "server_uploads")
+
+json_dumps = partial(json.dumps, ensure_ascii=False, default=float)
+
+
+def analysis_payload(dialogue, diarization):
+    """Диалог, диаризация и статистика в тех же структурах, что использует GUI"""
+    return {
+        "dialogue": [[speaker, text] for speaker, text in dialogue],
+        "diarization": [{"start": float(start), "end": float(end), "speaker": speaker}
+                        for start, end, speaker in diarization],
+        "statistics": calculate_statistics(dialogue, diarization),
+    }
+
+
+class StreamSession:
+    """Распознавание одного потока PCM на распознавателе из общего пула"""
+    
+    def __init__(self, sample_rate=16000, model_path=None):
+        """Инициализация сессии"""
+        self.sample_rate = sample_rate
+        self.model_path = model_path
+        self.recognizer = None
+        self.diarizer = None
+        self.results = []
+        self._last_partial = ""
+        self._leftover = b""  # Нечетный байт кадра - половина отсчета, дополняется следующим кадром
+    
+    def open(self):
+        """Взять распознаватель из пула (модель загружается, если еще не загружена)"""
+        from realtime_diarization_service import OnlineDiarizer
+        
+        self.recognizer = ModelManager().acquire_recognizer(self.sample_rate, self.model_path)
+        self.diarizer = OnlineDiarizer(sample_rate=self.sample_rate)
+    
+    def feed(self, data):
+        """Принять кусок PCM и вернуть события для клиента"""
+        # Кадры не обязаны делиться на отсчеты: хвост переносится, чтобы не сдвигать весь поток
+        data = self._leftover + data
+        split = len(data) // 2 * 2
+        data, self._leftover = data[:split], data[split:]
+        if not data:
+            return []
+        self.diarizer.feed(data)
+        if self.recognizer.AcceptWaveform(data):
+            result = json.loads(self.recognizer.Result())
+            self.results.append(result)
+            self._last_partial = ""
+            return [{"type": "result", "text": result.get("text", ""), "result": result.get("result", [])}]
+        
+        # Промежуточный результат отправляется, только если текст изменился
+        text = json.loads(self.recognizer.PartialResult()).get("partial", "")
+        if not text or text == self._last_partial:
+            return []
+        self._last_partial = text
+        return [{"type": "partial", "text": text}]
+    
+    def finish(self):
+        """Завершить поток: диалог по распознанным словам и онлайн-диаризации"""
+        from analyse_service import build_dialogue
+        
+        self.results.append(json.loads(self.recognizer.FinalResult()))
+        diarization = self.diarizer.get_timeline()
+        dialogue = build_dialogue(self.results, diarization)
+        return dict(analysis_payload(dialogue, diarization), type="final")
+    
+    def close(self):
+        """Вернуть распознаватель в пул"""
+        if self.recognizer is not None:
+            ModelManager().release_recognizer(self.recognizer)
+            self.recognizer = None
+
+
+class AnalysisServer:
+    """HTTP/WebSocket сервер поверх общей очереди анализа и пула распознавателей"""
+    
+    def __init__(self, analysis_workers=1, stream_workers=None, transcription_workers=None):
+        """Инициализация сервера
+        
+        analysis_workers - одновременных анализов файлов,
+        stream_workers - потоков для распознавания WebSocket-потоков,
+        transcription_workers - процессов транскрибации на анализ
+        (по умолчанию ядра и память делятся между одновременными анализами).
+        """
+        self.transcription_workers = transcription_workers or default_workers(
+            ModelManager().get_model_path(), concurrent=analysis_workers)
+        self.cache = AnalysisCache()
+        # Задачи сервера живут в пределах запроса (загрузки - во временных файлах),
+        # поэтому очередь не сохраняется и после перезапуска не восстанавливается
+        self.job_queue = AnalysisJobQueue(workers=analysis_workers, cache=self.cache, state_path=None)
+        self.job_queue.add_listener(self._on_job_event)
+        self.executor = ThreadPoolExecutor(max_workers=stream_workers or os.cpu_count() or 1)
+        self._waiters = {}  # id задачи -> (loop, future)
+        self._waiters_lock = threading.Lock()
+    
+    def create_app(self):
+        """Приложение aiohttp с маршрутами"""
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_get("/health", self.health)
+        app.router.add_post("/analyze", self.analyze)
+        app.router.add_get("/stream", self.stream)
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._on_shutdown)
+        return app
+    
+    async def _on_startup(self, app):
+        shutil.rmtree(UPLOAD_DIR, ignore_errors=True)
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        # Модели загружаются в фоне, пока сервер уже принимает запросы
+        ModelManager().preload()
+        if os.path.exists(SMALL_MODEL_PATH):
+            ModelManager().preload(SMALL_MODEL_PATH)
+        self.job_queue.start()
+    
+    async def _on_shutdown(self, app):
+        self.job_queue.shutdown()
+        self.executor.shutdown(wait=False)
+    
+    def _on_job_event(self, job, event):
+        """Завершение задачи будит ожидающий запрос (вызывается из потока очереди)"""
+        if event not in (JOB_DONE, JOB_FAILED, JOB_CANCELLED):
+            return
+        with self._waiters_lock:
+            waiter = self._waiters.pop(job.id, None)
+        if waiter is not None:
+            loop, future = waiter
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(job))
+    
+    async def run_job(self, audio_path, n_speakers):
+        """Поставить файл в очередь анализа и дождаться результата"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job = self.job_queue.submit(audio_path, n_speakers, parallel=True, workers=self.transcription_workers)
+        with self._waiters_lock:
+            self._waiters[job.id] = (loop, future)
+        # Задача могла завершиться до регистрации ожидания
+        if job.status in (JOB_DONE, JOB_FAILED, JOB_CANCELLED):
+            with self._waiters_lock:
+                self._waiters.pop(job.id, None)
+            return job
+        
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Клиент отключился - анализ больше не нужен
+            self.job_queue.cancel(job.id)
+            raise
+    
+    async def health(self, request):
+        """Состояние моделей"""
+        manager = ModelManager()
+        models = {manager.get_model_path(): manager.is_loaded()}
+        if os.path.exists(SMALL_MODEL_PATH):
+            models[SMALL_MODEL_PATH] = manager.is_loaded(SMALL_MODEL_PATH)
+        return web.json_response({"status": "ok", "models": models})
+    
+    async def analyze(self, request):
+        """Анализ файла по пути или загруженного файла"""
+        upload_path = None
+        try:
+            if request.content_type.startswith("multipart/"):
+                audio_path, n_speakers = None, "2"
+                reader = await request.multipart()
+                async for part in reader:
+                    if part.name == "file":
+                        suffix = os.path.splitext(part.filename or "")[1]
+                        with tempfile.NamedTemporaryFile(suffix=suffix, dir=UPLOAD_DIR, delete=False) as f:
+                            upload_path = audio_path = f.name
+                            while chunk := await part.read_chunk():
+                                f.write(chunk)
+                    elif part.name == "n_speakers":
+                        n_speakers = await part.text()
+            else:
+                try:
+                    body = await request.json()
+                except ValueError:
+                    return web.json_response({"error": "Ожидается JSON или multipart"}, status=400)
+                audio_path, n_speakers = body.get("path"), str(body.get("n_speakers", 2))
+            
+            if not audio_path or not os.path.exists(audio_path):
+                return web.json_response({"error": "Файл не найден"}, status=400)
+            n_speakers = n_speakers.strip().lower()
+            if n_speakers not in ("auto", "авто", "0") and not n_speakers.isdigit():
+                return web.json_response({"error": "n_speakers - число или 'auto'"}, status=400)
+            n_speakers = "auto" if not n_speakers.isdigit() or n_speakers == "0" else int(n_speakers)
+            
+            job = await self.run_job(audio_path, n_speakers)
+            if job.status != JOB_DONE:
+                return web.json_response({"error": str(job.error or job.status)}, status=500)
+            dialogue, diarization = job.result
+            return web.json_response(analysis_payload(dialogue, diarization), dumps=json_dumps)
+        finally:
+            if upload_path is not None:
+                os.remove(upload_path)
+    
+    async def stream(self, request):
+        """Распознавание потока PCM по WebSocket"""
+        try:
+            sample_rate = int(request.query.get("sample_rate", 16000))
+        except ValueError:
+            sample_rate = 0
+        if sample_rate <= 0:
+            return web.json_response({"error": "sample_rate - положительное целое число"}, status=400)
+        
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        
+        model_path = SMALL_MODEL_PATH if request.query.get("model") == "small" else None
+        session = StreamSession(sample_rate, model_path)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, session.open)
+            async for msg in ws:
+                if msg.type == WSMsgType.BINARY:
+                    events = await loop.run_in_executor(self.executor, session.feed, msg.data)
+                    for event in events:
+                        await ws.send_json(event, dumps=json_dumps)
+                elif msg.type == WSMsgType.TEXT and msg.data.strip() == "end":
+                    final = await loop.run_in_executor(self.executor, session.finish)
+                    await ws.send_json(final, dumps=json_dumps)
+                    break
+        except Exception as e:
+            print(f"Ошибка потока распознавания: {e}")
+            if not ws.closed:
+                await ws.send_json({"type": "error", "error": str(e)}, dumps=json_dumps)
+        finally:
+            session.close()
+            await ws.close()
+        return ws
+
+
+def main(argv=None):
+    """Запуск сервера"""
+    parser = argparse.ArgumentParser(description="ОТКЛИК - локальный сервер анализа")
+    parser.add_argument("--host", default="127.0.0.1", help="адрес (по умолчанию только локальный)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--analysis-workers", type=int, default=1, help="одновременных анализов файлов")
+    parser.add_argument("--stream-workers", type=int, default=None, help="потоков для WebSocket-распознавания")
+    parser.add_argument("--transcription-workers", type=int, default=None,
+                        help="процессов транскрибации на анализ (по умолчанию по ядрам и памяти)")
+    args = parser.parse_args(argv)
+    
+    # Сервер держит модели резидентными: простой не выгружает их, остается только бюджет памяти
+    ModelManager.idle_unload_sec = float("inf")
+    server = AnalysisServer(args.analysis_workers, args.stream_workers, args.transcription_workers)
+    web.run_app(server.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
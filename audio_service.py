@@ -0,0 +1,151 @@
+import threading
+import numpy as np
+import librosa
+import soundfile
+import soxr
+
+SAMPLE_RATE = 16000
+
+
+class DecodedAudio:
+    """Аудио, декодированное один раз (16 кГц, моно).
+    
+    Хранится как float32 или как PCM int16 (например, memmap из PcmCache);
+    во втором случае float32 вычисляется только при первом обращении к samples.
+    """
+    
+    def __init__(self, samples=None, sample_rate=SAMPLE_RATE, pcm=None):
+        """Инициализация контейнера аудио (samples - float32, pcm - int16)"""
+        self._samples = None if samples is None else np.asarray(samples, dtype=np.float32)
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self._samples_lock = threading.Lock()
+    
+    @property
+    def samples(self):
+        """Отсчеты float32 [-1, 1]"""
+        with self._samples_lock:
+            if self._samples is None:
+                self._samples = self.pcm.astype(np.float32)
+                self._samples /= 32767
+            return self._samples
+    
+    @property
+    def int16(self):
+        """PCM int16 представление (из float32 не кэшируется, чтобы не держать второй буфер)"""
+        if self.pcm is not None:
+            return self.pcm
+        return _to_int16(self._samples)
+    
+    def __len__(self):
+        return len(self.pcm) if self.pcm is not None else len(self._samples)
+    
+    @property
+    def duration(self):
+        """Длительность в секундах"""
+        return len(self) / self.sample_rate
+    
+    def iter_pcm_blocks(self, block_frames=4000, start=0, end=None):
+        """Генератор блоков PCM int16 (bytes) для KaldiRecognizer"""
+        end = len(self) if end is None else end
+        for block_start in range(start, end, block_frames):
+            yield self.pcm_bytes(block_start, min(block_start + block_frames, end))
+    
+    def pcm_bytes(self, start=0, end=None):
+        """PCM int16 (bytes) для диапазона отсчетов"""
+        if self.pcm is not None:
+            return self.pcm[start:end].tobytes()
+        return _to_int16(self._samples[start:end]).tobytes()
+
+
+def _to_int16(samples):
+    """Перевод float32 [-1, 1] в int16"""
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def decode_audio(audio_path, sr=SAMPLE_RATE, pcm_cache=None):
+    """Декодирует аудиофайл в 16 кГц моно.
+    
+    С pcm_cache (PcmCache) декодированный PCM берется из кэша через mmap,
+    а при промахе записывается туда потоково, блоками.
+    """
+    if isinstance(audio_path, DecodedAudio):
+        return audio_path
+    
+    if pcm_cache is not None:
+        pcm = pcm_cache.get(audio_path, sr)
+        if pcm is None:
+            pcm = pcm_cache.put(audio_path, sr, stream_pcm_blocks(audio_path, sr))
+        return DecodedAudio(sample_rate=sr, pcm=pcm)
+    
+    audio, _ = librosa.load(audio_path, sr=sr, mono=True)
+    return DecodedAudio(audio, sr)
+
+
+def stream_pcm_blocks(audio_path, sr=SAMPLE_RATE, block_frames=4000):
+    """Генератор блоков PCM int16 (bytes) 16 кГц моно прямо из файла.
+    
+    Файл читается и передискретизируется поблочно, поэтому память ограничена
+    размером блока, а не длиной записи. Форматы, которые soundfile не читает
+    (например, m4a), декодируются целиком через librosa.load.
+    """
+    if isinstance(audio_path, DecodedAudio):
+        yield from audio_path.iter_pcm_blocks(block_frames)
+        return
+    
+    try:
+        native_sr = soundfile.info(audio_path).samplerate
+    except RuntimeError:
+        yield from decode_audio(audio_path, sr).iter_pcm_blocks(block_frames)
+        return
+    
+    # Блок исходного файла, дающий после передискретизации ~block_frames отсчетов
+    native_block = max(1, block_frames * native_sr // sr)
+    # Потоковый ресемплер хранит состояние фильтра между блоками - без щелчков на стыках
+    resampler = soxr.ResampleStream(native_sr, sr, 1, dtype="float32") if native_sr != sr else None
+    blocks = librosa.stream(audio_path, block_length=1, frame_length=native_block, hop_length=native_block,
+                            mono=True)
+    for block in blocks:
+        if resampler is not None:
+            block = resampler.resample_chunk(block)
+        if len(block):
+            yield _to_int16(block).tobytes()
+    
+    if resampler is not None:
+        tail = resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+        if len(tail):
+            yield _to_int16(tail).tobytes()
+
+
+def split_at_silence(audio, chunk_sec=60.0, search_sec=5.0, frame_sec=0.03):
+    """Разбивает аудио на куски ~chunk_sec, разрезая в самых тихих местах.
+    
+    Возвращает список границ (start, end) в отсчетах.
+    """
+    sr = audio.sample_rate
+    total = len(audio)
+    chunk = int(chunk_sec * sr)
+    if total <= chunk:
+        return [(0, total)]
+    
+    # Энергия коротких фреймов (einsum не создает копию квадратов)
+    frame = max(1, int(frame_sec * sr))
+    n_frames = total // frame
+    frames = audio.samples[:n_frames * frame].reshape(n_frames, frame)
+    energy = np.einsum("ij,ij->i", frames, frames)
+    
+    search = int(search_sec * sr)
+    boundaries = []
+    start = 0
+    while total - start > chunk + search:
+        target = start + chunk
+        lo = max(start + frame, target - search) // frame
+        hi = min(n_frames, (target + search) // frame + 1)
+        if hi <= lo:
+            cut = target
+        else:
+            cut = (lo + int(np.argmin(energy[lo:hi]))) * frame + frame // 2
+        boundaries.append((start, cut))
+        start = cut
+    boundaries.append((start, total))
+    return boundaries
@@ -0,0 +1,216 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".m4a")
+MANIFEST_NAME = "manifest.json"
+
+
+def find_audio_files(source):
+    """Аудиофайлы из каталога (рекурсивно) или по маске glob"""
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            paths.extend(os.path.join(root, name) for name in files)
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(path for path in paths if path.lower().endswith(AUDIO_EXTENSIONS))
+
+
+def parse_speakers(value):
+    """Количество спикеров из аргумента ('auto' - автоопределение)"""
+    value = value.strip().lower()
+    if value in ("auto", "авто", "0"):
+        return "auto"
+    n_speakers = int(value)
+    if n_speakers <= 0:
+        raise argparse.ArgumentTypeError("количество спикеров должно быть положительным")
+    return n_speakers
+
+
+def output_prefix(audio_path, source_root, output_dir):
+    """Префикс выходных файлов (путь относительно источника, чтобы одинаковые имена не совпали)"""
+    relative = os.path.relpath(os.path.abspath(audio_path), source_root)
+    return os.path.join(output_dir, os.path.splitext(relative)[0].replace(os.sep, "__"))
+
+
+def file_signature(audio_path):
+    """Размер и время изменения файла (для проверки, что результат не устарел)"""
+    stat = os.stat(audio_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_manifest(output_dir):
+    """Журнал обработанных файлов"""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_dir, manifest):
+    """Сохранить журнал (через временный файл, чтобы прерывание его не испортило)"""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def is_done(entry, audio_path):
+    """Файл уже обработан, не менялся и результаты на месте"""
+    return (
+        entry is not None
+        and entry.get("status") == "done"
+        and entry.get("signature") == file_signature(audio_path)
+        and all(os.path.exists(path) for path in entry.get("outputs", []))
+    )
+
+
+def analyze_file(audio_path, n_speakers, prefix, use_cache, parallel_stages, transcription_workers=1,
+                 use_change_points=False):
+    """Анализ одного файла в процессе-воркере с записью результатов.
+    
+    transcription_workers - процессов для транскрибации файла по кускам
+    (больше одного, когда файлов меньше, чем воркеров по ядрам и памяти).
+    """
+    # Тяжелые модули импортируются в воркере
+    import librosa
+    from analyse_service import merge_transcription_diarization
+    from cache_service import AnalysisCache
+    from statistics_service import calculate_statistics
+    
+    started = time.perf_counter()
+    cache = AnalysisCache() if use_cache else None
+    # n_jobs=1: воркеров уже столько, сколько ядер, вложенные пулы их только перегрузят
+    dialogue, diarization = merge_transcription_diarization(audio_path, n_speakers, parallel=parallel_stages,
+                                                            workers=transcription_workers, cache=cache, n_jobs=1,
+                                                            use_change_points=use_change_points)
+    stats = calculate_statistics(dialogue, diarization)
+    processing_sec = time.perf_counter() - started
+    audio_sec = librosa.get_duration(path=audio_path)
+    
+    outputs = [f"{prefix}.txt", f"{prefix}.diarization.json", f"{prefix}.stats.json"]
+    with open(outputs[0], "w", encoding="utf-8") as f:
+        f.write(f"ОТКЛИК - {os.path.basename(audio_path)}\n")
+        f.write("="*50 + "\n\n")
+        for speaker, text in dialogue:
+            f.write(f"{speaker}: {text}\n\n")
+    
+    with open(outputs[1], "w", encoding="utf-8") as f:
+        segments = [{"start": float(start), "end": float(end), "speaker": speaker}
+                    for start, end, speaker in diarization]
+        json.dump(segments, f, ensure_ascii=False, indent=2)
+    
+    with open(outputs[2], "w", encoding="utf-8") as f:
+        json.dump(stats, f, ensure_ascii=False, indent=2, default=float)
+    
+    return {"audio_sec": audio_sec, "processing_sec": processing_sec, "outputs": outputs}
+
+
+def run_batch(source, output_dir, n_speakers=2, workers=None, use_cache=True, parallel_stages=False,
+              force=False, transcription_workers=None, use_change_points=False):
+    """Пакетный анализ: файлы распределяются по пулу процессов, готовые пропускаются.
+    
+    transcription_workers - процессов транскрибации на файл; по умолчанию ядра
+    и память, не занятые воркерами файлов, делятся между ними.
+    """
+    files = find_audio_files(source)
+    if not files:
+        print(f"❌ Аудиофайлы не найдены: {source}")
+        return 1
+    
+    os.makedirs(output_dir, exist_ok=True)
+    source_root = os.path.abspath(source if os.path.isdir(source) else os.path.commonpath(
+        [os.path.dirname(os.path.abspath(path)) for path in files]
+    ))
+    
+    manifest = {} if force else load_manifest(output_dir)
+    todo = [path for path in files if not is_done(manifest.get(os.path.abspath(path)), path)]
+    print(f"📋 Файлов: {len(files)}, уже обработано: {len(files) - len(todo)}, в очереди: {len(todo)}")
+    if not todo:
+        return 0
+    
+    from model_manager import ModelManager, default_workers
+    
+    total_workers = workers or default_workers(ModelManager().get_model_path())
+    workers = min(total_workers, len(todo))
+    if transcription_workers is None:
+        transcription_workers = max(1, total_workers // workers)
+    print(f"⚙️ Воркеров: {workers}, процессов транскрибации на файл: {transcription_workers}")
+    
+    started = time.perf_counter()
+    total_audio_sec = 0.0
+    failed = 0
+    # spawn: каждый воркер загружает свою модель и не наследует состояние родителя
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = {
+            executor.submit(analyze_file, path, n_speakers, output_prefix(path, source_root, output_dir),
+                            use_cache, parallel_stages, transcription_workers, use_change_points): path
+            for path in todo
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            key = os.path.abspath(path)
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                manifest[key] = {"status": "error", "error": str(e), "signature": file_signature(path)}
+                print(f"❌ [{done}/{len(todo)}] {path}: {e}")
+            else:
+                total_audio_sec += result["audio_sec"]
+                manifest[key] = dict(result, status="done", signature=file_signature(path))
+                rtf = result["processing_sec"] / max(result["audio_sec"], 1e-9)
+                print(f"✅ [{done}/{len(todo)}] {path}: {result['audio_sec']:.0f} с аудио "
+                      f"за {result['processing_sec']:.0f} с (RTF {rtf:.2f})")
+            # Журнал сохраняется после каждого файла, чтобы прерванный запуск можно было продолжить
+            save_manifest(output_dir, manifest)
+    except KeyboardInterrupt:
+        print("⏹ Прервано, при повторном запуске обработка продолжится")
+        executor.shutdown(wait=False, cancel_futures=True)
+        return 130
+    executor.shutdown()
+    
+    wall_sec = time.perf_counter() - started
+    if total_audio_sec:
+        print(f"📊 Итого: {total_audio_sec / 3600:.2f} ч аудио за {wall_sec / 60:.1f} мин, "
+              f"RTF {wall_sec / total_audio_sec:.3f} ({total_audio_sec / wall_sec:.1f}x быстрее реального времени)")
+    if failed:
+        print(f"⚠️ С ошибками: {failed}")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    """Точка входа командной строки"""
+    parser = argparse.ArgumentParser(description="ОТКЛИК - пакетный анализ аудиозаписей встреч")
+    parser.add_argument("source", help="каталог с записями или маска glob (например, 'archive/**/*.mp3')")
+    parser.add_argument("-o", "--output", default="batch_results", help="каталог для результатов")
+    parser.add_argument("-s", "--speakers", type=parse_speakers, default=2,
+                        help="количество спикеров или 'auto'")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="число процессов (по умолчанию по ядрам и свободной памяти)")
+    parser.add_argument("-t", "--transcription-workers", type=int, default=None,
+                        help="процессов транскрибации на файл (по умолчанию делят свободные ядра)")
+    parser.add_argument("--no-cache", action="store_true", help="не использовать кэш анализа")
+    parser.add_argument("--parallel-stages", action="store_true",
+                        help="транскрибация и диаризация файла одновременно (больше нагрузка на воркер)")
+    parser.add_argument("--change-points", action="store_true",
+                        help="сегментация по точкам смены спикера перед кластеризацией (экспериментально)")
+    parser.add_argument("--force", action="store_true", help="обработать заново уже готовые файлы")
+    args = parser.parse_args(argv)
+    
+    return run_batch(args.source, args.output, n_speakers=args.speakers, workers=args.workers,
+                     use_cache=not args.no_cache, parallel_stages=args.parallel_stages, force=args.force,
+                     transcription_workers=args.transcription_workers, use_change_points=args.change_points)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+CACHE_DIR = "cache"
+
+# Хэши файлов в рамках процесса: (путь, размер, mtime) -> sha256
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+
+def file_hash(path):
+    """SHA-256 содержимого файла (повторно для неизмененного файла не считается)"""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+    
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    
+    with _hash_lock:
+        _hash_memo[memo_key] = digest.hexdigest()
+    return _hash_memo[memo_key]
+
+
+def make_key(*parts):
+    """Ключ кэша из произвольных частей"""
+    return hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+class LruDirectory:
+    """Каталог файлов кэша с ограничением размера и вытеснением давно неиспользуемых"""
+    
+    def __init__(self, directory, max_bytes):
+        """Инициализация каталога"""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+    
+    def path(self, name):
+        """Путь к файлу в каталоге кэша"""
+        return os.path.join(self.directory, name)
+    
+    def touch(self, path):
+        """Отметить файл как использованный (время доступа хранится в mtime)"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+    
+    def evict(self):
+        """Удалить самые старые файлы, пока каталог не уложится в лимит"""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                path = self.path(name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+
+class FeatureCache(LruDirectory):
+    """Кэш матриц признаков (.npy рядом с кэшем анализа, открываются через mmap).
+    
+    Последние использованные массивы дополнительно держатся в памяти.
+    """
+    
+    def __init__(self, directory=os.path.join(CACHE_DIR, "features"), max_bytes=1024 * 1024 * 1024,
+                 memory_items=8):
+        """Инициализация кэша"""
+        super().__init__(directory, max_bytes)
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+    
+    def _remember(self, memo_key, array):
+        with self._memory_lock:
+            self._memory[memo_key] = array
+            self._memory.move_to_end(memo_key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+    
+    def get(self, key, name):
+        """Массив из кэша или None"""
+        memo_key = (key, name)
+        with self._memory_lock:
+            if memo_key in self._memory:
+                self._memory.move_to_end(memo_key)
+                return self._memory[memo_key]
+        
+        path = self.path(f"{key}_{name}.npy")
+        try:
+            array = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        self.touch(path)
+        self._remember(memo_key, array)
+        return array
+    
+    def put(self, key, name, array):
+        """Сохранить массив"""
+        path = self.path(f"{key}_{name}.npy")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+        np.save(tmp_path, np.asarray(array))
+        os.replace(tmp_path, path)
+        self._remember((key, name), array)
+        self.evict()
+
+
+def _open_pcm(path):
+    """PCM int16 из файла через mmap (данные читаются по мере обращения)"""
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.int16)
+    return np.memmap(path, dtype=np.int16, mode="r")
+
+
+class PcmCache(LruDirectory):
+    """Кэш декодированного аудио: сырой PCM int16 моно нужной частоты.
+    
+    Ключ - хэш содержимого и время изменения исходного файла. Файлы открываются
+    через np.memmap, поэтому повторный анализ не декодирует аудио заново,
+    а процессы-воркеры делят страничный кэш ОС вместо собственных копий.
+    """
+    
+    def __init__(self, directory=os.path.join(CACHE_DIR, "pcm"), max_bytes=2 * 1024 * 1024 * 1024):
+        """Инициализация кэша"""
+        super().__init__(directory, max_bytes)
+    
+    def _name(self, audio_path, sample_rate):
+        return f"{make_key(file_hash(audio_path), os.stat(audio_path).st_mtime_ns, sample_rate)}.pcm"
+    
+    def get(self, audio_path, sample_rate):
+        """PCM int16 (memmap) или None"""
+        path = self.path(self._name(audio_path, sample_rate))
+        try:
+            pcm = _open_pcm(path)
+        except (OSError, ValueError):
+            return None
+        self.touch(path)
+        return pcm
+    
+    def put(self, audio_path, sample_rate, blocks):
+        """Записать PCM из блоков bytes (без сборки в памяти) и вернуть его memmap"""
+        path = self.path(self._name(audio_path, sample_rate))
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                for block in blocks:
+                    f.write(block)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        # Файл открывается до вытеснения: отображение переживает удаление файла
+        pcm = _open_pcm(path)
+        self.evict()
+        return pcm
+
+
+class AnalysisCache(LruDirectory):
+    """Дисковый кэш результатов анализа по хэшу содержимого аудиофайла.
+    
+    Транскрибация зависит только от файла и модели, поэтому при смене
+    количества спикеров переиспользуется.
+    """
+    
+    def __init__(self, directory=os.path.join(CACHE_DIR, "analysis"), max_bytes=256 * 1024 * 1024):
+        """Инициализация кэша"""
+        super().__init__(directory, max_bytes)
+        # Признаки диаризации для быстрого перезапуска с другим числом спикеров
+        self.features = FeatureCache()
+        # Декодированное аудио, чтобы повторный анализ не декодировал файл заново
+        self.pcm = PcmCache()
+    
+    def _read(self, name):
+        path = self.path(name)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.touch(path)
+        return payload
+    
+    def _write(self, name, payload):
+        # Запись через временный файл, чтобы не оставить битую запись
+        path = self.path(name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self.evict()
+    
+    def _transcription_name(self, audio_path, model_path):
+        return f"transcription_{make_key(file_hash(audio_path), model_path)}.json"
+    
+    def _analysis_name(self, audio_path, model_path, n_speakers, use_change_points=False):
+        # Ключ без флага совпадает с прежним, уже сохраненные результаты остаются действительными
+        parts = [file_hash(audio_path), model_path, n_speakers] + (["change_points"] if use_change_points else [])
+        return f"analysis_{make_key(*parts)}.json"
+    
+    def get_transcription(self, audio_path, model_path):
+        """Результат транскрибации или None"""
+        return self._read(self._transcription_name(audio_path, model_path))
+    
+    def put_transcription(self, audio_path, model_path, transcription):
+        """Сохранить результат транскрибации"""
+        self._write(self._transcription_name(audio_path, model_path), transcription)
+    
+    def get_analysis(self, audio_path, model_path, n_speakers, use_change_points=False):
+        """Сохраненные диалог и диаризация (в виде словаря) или None"""
+        return self._read(self._analysis_name(audio_path, model_path, n_speakers, use_change_points))
+    
+    def put_analysis(self, audio_path, model_path, n_speakers, dialogue, diarization, use_change_points=False):
+        """Сохранить диалог и диаризацию (словарь SpeakerTimeline.to_dict)"""
+        payload = {"dialogue": [list(turn) for turn in dialogue], "diarization": diarization}
+        self._write(self._analysis_name(audio_path, model_path, n_speakers, use_change_points), payload)
@@ -0,0 +1,191 @@
+import threading
+import numpy as np
+import pyaudio
+
+
+class PcmRingBuffer:
+    """Кольцевой буфер PCM int16 с абсолютными позициями для независимых читателей"""
+    
+    def __init__(self, capacity_samples):
+        """Инициализация буфера"""
+        self.capacity = capacity_samples
+        self._data = np.zeros(capacity_samples, dtype=np.int16)
+        self.total_written = 0  # Абсолютная позиция записи (в отсчетах)
+        self.closed = False
+        self._cond = threading.Condition()
+    
+    def write(self, data):
+        """Записать кусок PCM (bytes).
+        
+        Кусок больше емкости сохраняется только последними capacity отсчетами,
+        но позиция записи сдвигается на всю длину: читатели получают отброшенное
+        начало как потерянные отсчеты.
+        """
+        samples = np.frombuffer(data, dtype=np.int16)
+        total = len(samples)
+        skipped = max(0, total - self.capacity)
+        samples = samples[skipped:]
+        with self._cond:
+            start = (self.total_written + skipped) % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self._data[start:start + first] = samples[:first]
+            self._data[:len(samples) - first] = samples[first:]
+            self.total_written += total
+            self._cond.notify_all()
+    
+    def read(self, position, min_samples, max_samples, timeout=None):
+        """Прочитать от position не менее min_samples (если буфер не закрыт).
+        
+        Возвращает (bytes или None, новая позиция, число потерянных отсчетов).
+        Потеря возникает, если читатель отстал больше, чем на емкость буфера.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.closed or self.total_written - position >= min_samples, timeout
+            )
+            
+            dropped = max(0, self.total_written - self.capacity - position)
+            position += dropped
+            n = min(max_samples, self.total_written - position)
+            if n <= 0 or (n < min_samples and not self.closed):
+                return None, position, dropped
+            
+            start = position % self.capacity
+            first = min(n, self.capacity - start)
+            data = self._data[start:start + first].tobytes() + self._data[:n - first].tobytes()
+            return data, position + n, dropped
+    
+    def close(self):
+        """Закрыть буфер и разбудить читателей"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+    
+    def reopen(self):
+        """Снова принимать данные после close"""
+        with self._cond:
+            self.closed = False
+
+
+class CaptureSubscription:
+    """Потребитель общего захвата со своим курсором в кольцевом буфере"""
+    
+    def __init__(self, engine, block_samples):
+        """Инициализация подписки с текущей позиции захвата"""
+        self.engine = engine
+        self.block_samples = block_samples
+        self.position = engine.ring.total_written
+        self.dropped_samples = 0
+    
+    def read(self, timeout=0.5):
+        """Следующий блок PCM (bytes) или None по таймауту"""
+        data, self.position, dropped = self.engine.ring.read(
+            self.position, self.block_samples, self.block_samples, timeout
+        )
+        self.dropped_samples += dropped
+        return data
+    
+    def read_available(self, max_samples, timeout=0.5):
+        """Все накопленные данные (не меньше блока, не больше max_samples) или None"""
+        data, self.position, dropped = self.engine.ring.read(
+            self.position, self.block_samples, max_samples, timeout
+        )
+        self.dropped_samples += dropped
+        return data
+    
+    def skip_to_latest(self, keep_samples=0):
+        """Пропустить накопленное, оставив последние keep_samples; возвращает число пропущенных"""
+        target = self.engine.ring.total_written - keep_samples
+        skipped = max(0, target - self.position)
+        self.position += skipped
+        self.dropped_samples += skipped
+        return skipped
+    
+    @property
+    def lag_samples(self):
+        """Отставание от захвата в отсчетах"""
+        return self.engine.ring.total_written - self.position
+    
+    def close(self):
+        """Отписаться от захвата"""
+        self.engine.unsubscribe(self)
+
+
+class AudioCaptureEngine:
+    """Единый захват микрофона: один поток PyAudio раздает PCM всем потребителям.
+    
+    Потребители (запись в файл, распознавание, VAD, индикатор уровня) читают
+    из общего кольцевого буфера со своими курсорами, поэтому отсчеты у всех совпадают.
+    """
+    
+    def __init__(self, sample_rate=16000, channels=1, frames_per_buffer=1024, buffer_sec=30.0):
+        """Инициализация захвата"""
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames_per_buffer = frames_per_buffer
+        self.format = pyaudio.paInt16
+        
+        self.audio = pyaudio.PyAudio()
+        self.stream = None
+        self.ring = PcmRingBuffer(int(buffer_sec * sample_rate * channels))
+        self.level = 0.0  # Уровень последнего блока (RMS, 0..1) для индикатора
+        
+        self._lock = threading.Lock()
+        self._users = 0
+        self._subscriptions = []
+    
+    def subscribe(self, block_samples=None):
+        """Новый потребитель, читающий с текущей позиции"""
+        subscription = CaptureSubscription(self, block_samples or self.frames_per_buffer)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        """Удалить потребителя"""
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+    
+    def start(self):
+        """Запустить захват (поток открывается при первом пользователе)"""
+        with self._lock:
+            self._users += 1
+            if self.stream is not None:
+                return
+            self.ring.reopen()
+            self.stream = self.audio.open(
+                format=self.format,
+                channels=self.channels,
+                rate=self.sample_rate,
+                input=True,
+                frames_per_buffer=self.frames_per_buffer,
+                stream_callback=self._audio_callback
+            )
+            self.stream.start_stream()
+    
+    def stop(self):
+        """Остановить захват (поток закрывается, когда ушел последний пользователь)"""
+        with self._lock:
+            self._users = max(0, self._users - 1)
+            if self._users or self.stream is None:
+                return
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        self.ring.close()
+    
+    def _audio_callback(self, in_data, frame_count, time_info, status):
+        """Callback PyAudio: запись в общий буфер и уровень для индикатора"""
+        self.ring.write(in_data)
+        samples = np.frombuffer(in_data, dtype=np.int16)
+        if len(samples):
+            self.level = float(np.sqrt(np.einsum("i,i->", samples, samples, dtype=np.float64) / len(samples))) / 32768
+        return (None, pyaudio.paContinue)
+    
+    def terminate(self):
+        """Освободить устройство"""
+        with self._lock:
+            self._users = 1 if self.stream is not None else 0
+        self.stop()
+        self.audio.terminate()
@@ -1,10 +1,178 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
 import librosa
 from sklearn.mixture import GaussianMixture
 from scipy.spatial.distance import cdist
+from audio_service import DecodedAudio, decode_audio
+from cache_service import file_hash, make_key
+
+UNKNOWN_SPEAKER = "Speaker_Unknown"
+
+# Значение n_speakers для автоматического определения числа спикеров
+AUTO_SPEAKERS = "auto"
+
+# Меньше стольких окон GMM обучаются в текущем процессе: запуск пула (spawn и импорт sklearn)
+# дольше самих обучений
+PARALLEL_GMM_MIN_FRAMES = 20000
+
+
+class SpeakerTimeline:
+    """Отсортированные непересекающиеся интервалы спикеров на массивах NumPy.
+    
+    Спикеры хранятся целочисленными id и таблицей имен label_table.
+    Поиск спикера по времени - бинарный (searchsorted), для всех слов сразу.
+    Итерация и индексация отдают кортежи (start, end, speaker), как раньше.
+    """
+    
+    def __init__(self, starts, ends, speaker_ids, label_table):
+        """Инициализация по массивам начал, концов, id спикеров и таблице имен"""
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        speaker_ids = np.asarray(speaker_ids, dtype=np.int32)
+        
+        if len(starts) > 1 and np.any(np.diff(starts) < 0):
+            order = np.argsort(starts, kind="stable")
+            starts, ends, speaker_ids = starts[order], ends[order], speaker_ids[order]
+        
+        self.starts = starts
+        self.ends = ends
+        self.speaker_ids = speaker_ids
+        self.label_table = tuple(label_table)
+    
+    @classmethod
+    def from_segments(cls, segments):
+        """Построить из списка кортежей (start, end, speaker)"""
+        if isinstance(segments, cls):
+            return segments
+        
+        label_table = []
+        label_ids = {}
+        starts, ends, speaker_ids = [], [], []
+        for start, end, speaker in segments:
+            if speaker not in label_ids:
+                label_ids[speaker] = len(label_table)
+                label_table.append(speaker)
+            starts.append(start)
+            ends.append(end)
+            speaker_ids.append(label_ids[speaker])
+        return cls(starts, ends, speaker_ids, label_table)
+    
+    @classmethod
+    def from_frame_labels(cls, frame_labels, hop_sec, label_table, min_segment_sec=0.0):
+        """Сжать покадровые метки в реплики (run-length), -1 означает тишину.
+        
+        min_segment_sec - реплики короче этого порога присоединяются к соседнему спикеру.
+        """
+        frame_labels = np.asarray(frame_labels, dtype=np.int32)
+        if len(frame_labels) == 0:
+            return cls([], [], [], label_table)
+        
+        run_starts, run_ends, run_ids = _run_length_encode(frame_labels)
+        
+        min_frames = int(round(min_segment_sec / hop_sec))
+        if min_frames > 1:
+            run_starts, run_ends, run_ids = _smooth_runs(run_starts, run_ends, run_ids, min_frames)
+        
+        # Тишина не попадает в реплики - между ними остаются паузы
+        speech = run_ids >= 0
+        return cls(run_starts[speech] * hop_sec, run_ends[speech] * hop_sec,
+                   run_ids[speech], label_table)
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Восстановить из словаря to_dict"""
+        return cls(data["starts"], data["ends"], data["speaker_ids"], data["label_table"])
+    
+    def to_dict(self):
+        """Словарь для сохранения в JSON"""
+        return {
+            "starts": self.starts.tolist(),
+            "ends": self.ends.tolist(),
+            "speaker_ids": self.speaker_ids.tolist(),
+            "label_table": list(self.label_table),
+        }
+    
+    @property
+    def labels(self):
+        """Имена спикеров для каждого интервала"""
+        return np.asarray(self.label_table, dtype=object)[self.speaker_ids]
+    
+    def speaker_at(self, time, default=UNKNOWN_SPEAKER):
+        """Спикер в заданное время"""
+        idx = np.searchsorted(self.starts, time, side="right") - 1
+        if idx >= 0 and time < self.ends[idx]:
+            return self.label_table[self.speaker_ids[idx]]
+        return default
+    
+    def speakers_at(self, times, default=UNKNOWN_SPEAKER):
+        """Спикеры для массива времен одним векторным вызовом"""
+        times = np.asarray(times, dtype=np.float64)
+        names = np.asarray(self.label_table + (default,), dtype=object)
+        if len(self.starts) == 0:
+            return names[np.full(len(times), len(self.label_table))]
+        
+        idx = np.searchsorted(self.starts, times, side="right") - 1
+        safe_idx = np.clip(idx, 0, None)
+        inside = (idx >= 0) & (times < self.ends[safe_idx])
+        return names[np.where(inside, self.speaker_ids[safe_idx], len(self.label_table))]
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def __iter__(self):
+        for start, end, speaker_id in zip(self.starts.tolist(), self.ends.tolist(), self.speaker_ids.tolist()):
+            yield start, end, self.label_table[speaker_id]
+    
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return SpeakerTimeline(self.starts[idx], self.ends[idx], self.speaker_ids[idx], self.label_table)
+        return float(self.starts[idx]), float(self.ends[idx]), self.label_table[self.speaker_ids[idx]]
+
+
+# Run-length кодирование меток: границы и id каждой серии
+def _run_length_encode(labels):
+    change = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+    run_starts = np.concatenate(([0], change))
+    run_ends = np.concatenate((change, [len(labels)]))
+    return run_starts, run_ends, labels[run_starts]
+
+# Сглаживание: короткие реплики отдаются более длинному соседнему спикеру
+def _smooth_runs(run_starts, run_ends, run_ids, min_frames):
+    run_ids = run_ids.copy()
+    lengths = run_ends - run_starts
+    
+    for i in np.argsort(lengths, kind="stable"):
+        if lengths[i] >= min_frames:
+            break
+        if run_ids[i] < 0:
+            continue
+        neighbours = [j for j in (i - 1, i + 1)
+                      if 0 <= j < len(run_ids) and run_ids[j] >= 0 and run_ids[j] != run_ids[i]]
+        if neighbours:
+            run_ids[i] = run_ids[max(neighbours, key=lambda j: lengths[j])]
+    
+    # Склеиваем соседние серии, ставшие одинаковыми
+    keep = np.concatenate(([True], run_ids[1:] != run_ids[:-1]))
+    new_starts = run_starts[keep]
+    new_ends = np.concatenate((new_starts[1:], [run_ends[-1]]))
+    return new_starts, new_ends, run_ids[keep]
+
 
 # Загрузка и предобработка аудио
-def load_audio(file_path, sr=16000):
+def load_audio(file_path, sr=16000, pcm_cache=None):
+    # Уже декодированное аудио используется без повторной загрузки
+    if isinstance(file_path, DecodedAudio):
+        if file_path.sample_rate == sr:
+            return file_path.samples
+        return librosa.resample(file_path.samples, orig_sr=file_path.sample_rate, target_sr=sr)
+    
+    # С pcm_cache декодированный PCM открывается из кэша через mmap
+    if pcm_cache is not None:
+        return decode_audio(file_path, sr, pcm_cache).samples
+    
     audio, _ = librosa.load(file_path, sr=sr, mono=True)
     return audio
 
@@ -22,46 +190,230 @@ def extract_features(audio, sr=16000, window_sec=1.0, hop_sec=0.5):
     features = (features - np.mean(features, axis=0)) / (np.std(features, axis=0) + 1e-8)
     return features
 
+# Маска тихих окон (RMS ниже порога относительно максимума), совпадает по кадрам с MFCC
+def compute_silence_mask(audio, sr=16000, window_sec=1.0, hop_sec=0.5, threshold_db=-40.0):
+    rms = librosa.feature.rms(y=audio, frame_length=int(window_sec * sr),
+                              hop_length=int(hop_sec * sr))[0]
+    db = 20 * np.log10(rms / (np.max(rms) + 1e-10) + 1e-10)
+    return db < threshold_db
+
+# Признаки и маска тишины для файла; с feature_cache они считаются один раз на файл,
+# и при смене числа спикеров заново выполняется только обучение GMM
+def load_diarization_features(file_path, audio=None, feature_cache=None, hop_sec=0.5, silence_db=-40.0,
+                              pcm_cache=None):
+    key = None
+    if feature_cache is not None and not isinstance(file_path, DecodedAudio):
+        key = make_key(file_hash(file_path), "mfcc13", hop_sec, silence_db)
+        features = feature_cache.get(key, "features")
+        silence = feature_cache.get(key, "silence")
+        if features is not None and silence is not None:
+            return features, silence
+    
+    audio = load_audio(audio if audio is not None else file_path, pcm_cache=pcm_cache)
+    features = extract_features(audio, hop_sec=hop_sec)
+    silence = compute_silence_mask(audio, hop_sec=hop_sec, threshold_db=silence_db)[:len(features)]
+    silence = np.pad(silence, (0, len(features) - len(silence)))
+    
+    if key is not None:
+        feature_cache.put(key, "features", features)
+        feature_cache.put(key, "silence", silence)
+    return features, silence
+
+# Разность BIC в масштабе 2 * log-правдоподобия: > 0 - сегменты от разных спикеров.
+# penalty=1 - исходный штраф compute_bic, penalty=2 соответствует стандартному BIC (lambda=1)
+def _bic_delta(n1, n2, logdet, logdet1, logdet2, d, penalty=1.0):
+    n = n1 + n2
+    return n * logdet - n1 * logdet1 - n2 * logdet2 - \
+           penalty * 0.5 * (d + 0.5 * d * (d + 1)) * np.log(n)
+
+# Логарифм определителя ковариации (slogdet не переполняется, в отличие от det)
+def _logdet_cov(features, reg=1e-6):
+    d = features.shape[1]
+    return np.linalg.slogdet(np.cov(features.T) + np.eye(d) * reg)[1]
+
 # Вычисление BIC для сравнения сегментов
-def compute_bic(features1, features2):
+def compute_bic(features1, features2, penalty=1.0):
     n1, n2 = len(features1), len(features2)
     d = features1.shape[1]
     
     combined = np.vstack([features1, features2])
     
-    cov1 = np.cov(features1.T) + np.eye(d) * 1e-6
-    cov2 = np.cov(features2.T) + np.eye(d) * 1e-6
-    cov_combined = np.cov(combined.T) + np.eye(d) * 1e-6
+    return _bic_delta(n1, n2, _logdet_cov(combined), _logdet_cov(features1),
+                      _logdet_cov(features2), d, penalty)
+
+# Префиксные суммы признаков и их внешних произведений:
+# ковариация любого отрезка [a, b) получается за O(d^2) без пересчета по кадрам
+def _prefix_sums(features):
+    n, d = features.shape
+    s1 = np.zeros((n + 1, d))
+    s2 = np.zeros((n + 1, d, d))
+    np.cumsum(features, axis=0, out=s1[1:])
+    np.cumsum(np.einsum("ni,nj->nij", features, features), axis=0, out=s2[1:])
+    return s1, s2
+
+# log|cov| для набора отрезков [starts, ends) по префиксным суммам (несмещенная оценка, как np.cov)
+def _segments_logdet(s1, s2, starts, ends, reg=1e-6):
+    counts = (ends - starts).astype(np.float64)
+    sums = s1[ends] - s1[starts]
+    means = sums / counts[:, None]
+    scatter = s2[ends] - s2[starts] - counts[:, None, None] * np.einsum("ni,nj->nij", means, means)
+    covs = scatter / (counts - 1)[:, None, None] + np.eye(s1.shape[1]) * reg
+    return np.linalg.slogdet(covs)[1]
+
+# Поиск смен спикера растущим/скользящим окном (Chen & Gopalakrishnan):
+# в каждом окне BIC считается сразу для всех точек разбиения. Окно растет от window
+# до max_window, пока смена не найдена, затем сдвигается на step.
+# Все размеры - в кадрах признаков, возвращаются индексы кадров смены спикера
+# (min_frames заметно больше размерности, иначе ковариации вырождены и дают ложные смены).
+# Смена принимается, только если лучшее разбиение дальше edge кадров от правого края диапазона
+def detect_change_points(features, window=60, max_window=120, step=10, min_frames=20, penalty=1.0, edge=None):
+    n, d = features.shape
+    min_frames = max(min_frames, d + 2)
+    edge = step if edge is None else edge
+    window = max(window, 2 * min_frames)
+    if n < 2 * min_frames:
+        return np.array([], dtype=np.int64)
     
-    bic = (n1 + n2) * np.log(np.linalg.det(cov_combined)) - \
-          n1 * np.log(np.linalg.det(cov1)) - \
-          n2 * np.log(np.linalg.det(cov2)) - \
-          0.5 * (d + 0.5 * d * (d + 1)) * np.log(n1 + n2)
+    s1, s2 = _prefix_sums(np.asarray(features, dtype=np.float64))
     
-    return bic
+    change_points = []
+    start = 0
+    end = min(start + window, n)
+    while end - start >= 2 * min_frames:
+        splits = np.arange(start + min_frames, end - min_frames + 1)
+        starts = np.full(len(splits), start)
+        ends = np.full(len(splits), end)
+        
+        logdet = _segments_logdet(s1, s2, np.array([start]), np.array([end]))[0]
+        bic = _bic_delta(splits - start, end - splits, logdet,
+                         _segments_logdet(s1, s2, starts, splits),
+                         _segments_logdet(s1, s2, splits, ends), d, penalty)
+        
+        best = int(np.argmax(bic))
+        # Лучшее разбиение у правого края окна - настоящая граница может быть дальше,
+        # тогда окно растет (сдвигается), пока она не окажется внутри
+        at_edge = splits[best] > end - min_frames - edge and end < n
+        if bic[best] > 0 and not at_edge:
+            # Смена найдена - следующее окно начинается с нее
+            change_points.append(int(splits[best]))
+            start = int(splits[best])
+            end = min(start + window, n)
+        elif end == n:
+            break
+        elif end - start < max_window:
+            end = min(end + step, n)
+        else:
+            start += step
+            end = min(start + max_window, n)
+    
+    return np.array(change_points, dtype=np.int64)
 
-# Диаризация через GMM
-def diarize_gmm(features, n_speakers=2):
+# Диаризация через GMM; при заданных change_points метка выбирается
+# для целого сегмента между сменами по сумме апостериорных вероятностей
+def diarize_gmm(features, n_speakers=2, change_points=None):
     gmm = GaussianMixture(n_components=n_speakers, covariance_type='diag', 
                           max_iter=100, random_state=42, reg_covar=1e-4)
     labels = gmm.fit_predict(features)
+    if change_points is None or len(change_points) == 0:
+        return labels
+    
+    bounds = np.concatenate(([0], change_points))
+    log_proba = np.log(gmm.predict_proba(features) + 1e-10)
+    segment_labels = np.argmax(np.add.reduceat(log_proba, bounds, axis=0), axis=1)
+    lengths = np.diff(np.concatenate((bounds, [len(features)])))
+    return np.repeat(segment_labels, lengths)
+
+# Обучение одной GMM и ее BIC (выполняется в процессе пула)
+def _fit_gmm_bic(features, n_components):
+    gmm = GaussianMixture(n_components=n_components, covariance_type='diag', 
+                          max_iter=100, random_state=42, reg_covar=1e-4)
+    gmm.fit(features)
+    return n_components, gmm.bic(features)
+
+# Оценка числа спикеров: GMM для каждого числа компонент, выбор по минимальному BIC.
+# n_jobs - процессов для обучения (по умолчанию по числу ядер); на коротких записях
+# и при n_jobs=1 (например, в воркерах пакетного анализа) GMM обучаются последовательно
+def estimate_n_speakers(features, min_speakers=1, max_speakers=8, n_jobs=None):
+    max_speakers = max(min_speakers, min(max_speakers, len(features) - 1))
+    counts = list(range(min_speakers, max_speakers + 1))
+    if len(counts) == 1:
+        return counts[0]
+    
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(counts))
+    if n_jobs <= 1 or len(features) < PARALLEL_GMM_MIN_FRAMES:
+        results = [_fit_gmm_bic(features, n_components) for n_components in counts]
+        return min(results, key=lambda result: result[1])[0]
+    
+    features = np.ascontiguousarray(features)
+    # spawn: пул не наследует потоки GUI и загруженную модель Vosk
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context("spawn")) as executor:
+        results = list(executor.map(_fit_gmm_bic, repeat(features), counts))
+    
+    return min(results, key=lambda result: result[1])[0]
+
+# Проверка смен спикера через BIC: если соседние реплики статистически
+# не различаются (BIC <= 0), смена считается ложной и реплики склеиваются
+def merge_false_changes(features, labels, min_frames=None):
+    d = features.shape[1]
+    min_frames = min_frames or d + 2
+    labels = labels.copy()
+    run_starts, run_ends, run_ids = _run_length_encode(labels)
+    
+    prev_start, prev_end, prev_id = run_starts[0], run_ends[0], run_ids[0]
+    for start, end, run_id in zip(run_starts[1:], run_ends[1:], run_ids[1:]):
+        if (run_id != prev_id and end - start >= min_frames and prev_end - prev_start >= min_frames
+                and compute_bic(features[prev_start:prev_end], features[start:end]) <= 0):
+            labels[start:end] = prev_id
+            prev_end = end
+        else:
+            prev_start, prev_end, prev_id = start, end, run_id
     return labels
 
 # Основная функция диаризации
-def diarize_audio(file_path, n_speakers=2):
-    audio = load_audio(file_path)
-    features = extract_features(audio)
-    labels = diarize_gmm(features, n_speakers)
-    
-    # Формирование временных меток
+# compact=True - реплики вместо окон по 0.5 с, тихие окна становятся паузами;
+# min_segment_sec - порог сглаживания коротких реплик;
+# feature_cache - FeatureCache, аудио декодируется только при промахе кэша;
+# n_speakers=AUTO_SPEAKERS - число спикеров (до max_speakers) оценивается по BIC;
+# use_change_points - сегментация по BIC перед кластеризацией (выключена, пока точность
+# границ не проверена на реальных записях);
+# n_jobs - процессов для оценки числа спикеров (см. estimate_n_speakers);
+# cancel_check - вызывается между шагами и выбрасывает исключение при отмене
+def diarize_audio(file_path, n_speakers=2, audio=None, compact=True, min_segment_sec=1.0,
+                  silence_db=-40.0, feature_cache=None, max_speakers=8, use_change_points=False, pcm_cache=None,
+                  n_jobs=None, cancel_check=None):
+    cancel_check = cancel_check or (lambda: None)
     hop_sec = 0.5
-    timestamps = []
-    for i, label in enumerate(labels):
-        start_time = i * hop_sec
-        end_time = (i + 1) * hop_sec
-        timestamps.append((start_time, end_time, f"Speaker_{label}"))
+    features, silence = load_diarization_features(file_path, audio, feature_cache, hop_sec, silence_db, pcm_cache)
+    cancel_check()
+    
+    if not compact:
+        silence = np.zeros(len(features), dtype=bool)
+    speech_features = features[~silence]
+    
+    auto = n_speakers == AUTO_SPEAKERS
+    if auto:
+        n_speakers = estimate_n_speakers(speech_features, max_speakers=max_speakers, n_jobs=n_jobs)
+        cancel_check()
+    label_table = [f"Speaker_{label}" for label in range(n_speakers)]
+    
+    # Модель обучается только на речевых окнах
+    labels = np.full(len(features), -1, dtype=np.int32)
+    if len(speech_features) >= n_speakers:
+        change_points = detect_change_points(speech_features) if use_change_points else None
+        cancel_check()
+        speech_labels = diarize_gmm(speech_features, n_speakers, change_points)
+        cancel_check()
+        if auto:
+            speech_labels = merge_false_changes(speech_features, speech_labels)
+        labels[~silence] = speech_labels
+    
+    if not compact:
+        # Окна без метки (речи меньше, чем спикеров) отбрасываются, как тишина в from_frame_labels,
+        # иначе label_table[-1] выдал бы их за последнего спикера
+        starts = np.flatnonzero(labels >= 0) * hop_sec
+        return SpeakerTimeline(starts, starts + hop_sec, labels[labels >= 0], label_table)
     
-    return timestamps
+    return SpeakerTimeline.from_frame_labels(labels, hop_sec, label_table, min_segment_sec)
 
 if __name__ == "__main__":
     results = diarize_audio("examples/e2.mp3", n_speakers=5)
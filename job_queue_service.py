@@ -0,0 +1,265 @@
+import os
+import json
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from cache_service import CACHE_DIR
+
+# Состояния задачи
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    """Задача анализа отменена пользователем"""
+
+
+class AnalysisJob:
+    """Задача анализа одного аудиофайла"""
+    
+    def __init__(self, audio_path, n_speakers=2, priority=0, options=None, job_id=None, created=None):
+        """Инициализация задачи (чем больше priority, тем раньше запуск)"""
+        self.id = job_id or uuid.uuid4().hex
+        self.audio_path = audio_path
+        self.n_speakers = n_speakers
+        self.priority = priority
+        self.options = options or {}
+        self.created = created or time.time()
+        self.status = JOB_QUEUED
+        self.stage = ""
+        self.progress = 0.0
+        self.message = ""
+        self.error = None
+        self.result = None  # (dialogue, SpeakerTimeline) после завершения
+        self._cancel = threading.Event()
+    
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+    
+    def to_dict(self):
+        """Словарь для сохранения очереди (несериализуемые параметры не сохраняются)"""
+        options = {}
+        for key, value in self.options.items():
+            try:
+                json.dumps(value)
+            except TypeError:
+                continue
+            options[key] = value
+        return {
+            "id": self.id,
+            "audio_path": self.audio_path,
+            "n_speakers": self.n_speakers,
+            "priority": self.priority,
+            "options": options,
+            "created": self.created,
+        }
+    
+    @classmethod
+    def from_dict(cls, payload):
+        """Восстановить из сохраненного словаря"""
+        return cls(payload["audio_path"], payload["n_speakers"], payload["priority"], payload["options"],
+                   job_id=payload["id"], created=payload["created"])
+
+
+class AnalysisJobQueue:
+    """Очередь задач анализа с приоритетами и фиксированным числом рабочих потоков.
+    
+    Незавершенные задачи сохраняются на диск и восстанавливаются при следующем запуске.
+    Отмена кооперативная: задача прерывается на ближайшей проверке внутри этапов анализа
+    (между блоками распознавания и шагами диаризации).
+    """
+    
+    def __init__(self, workers=1, state_path=os.path.join(CACHE_DIR, "jobs.json"), cache=None):
+        """Инициализация очереди (cache - AnalysisCache для анализа, state_path=None - без сохранения)"""
+        self.workers = workers
+        self.state_path = state_path
+        self.cache = cache
+        
+        self._jobs = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._listeners = []
+        self._threads = []
+        self._running = False
+    
+    def add_listener(self, callback):
+        """Подписаться на события задач: callback(job, event), event - состояние или 'progress'"""
+        self._listeners.append(callback)
+    
+    def _emit(self, job, event):
+        for callback in self._listeners:
+            try:
+                callback(job, event)
+            except Exception as e:
+                print(f"Ошибка обработчика очереди: {e}")
+    
+    def start(self):
+        """Восстановить сохраненные задачи и запустить рабочие потоки"""
+        if self._running:
+            return
+        self._running = True
+        for job in self._load_state():
+            if job.id in self._jobs:
+                continue
+            self._register(job)
+            self._emit(job, JOB_QUEUED)
+            self._enqueue(job)
+        
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def submit(self, audio_path, n_speakers=2, priority=0, **options):
+        """Поставить файл в очередь; options передаются в merge_transcription_diarization"""
+        job = AnalysisJob(audio_path, n_speakers, priority, options)
+        # Событие queued отправляется до того, как задачу увидят рабочие потоки,
+        # иначе подписчики могли бы получить его после running или done
+        self._register(job)
+        self._save_state()
+        self._emit(job, JOB_QUEUED)
+        self._enqueue(job)
+        return job
+    
+    def _register(self, job):
+        """Добавить задачу в реестр (рабочие потоки ее еще не видят)"""
+        with self._cond:
+            self._jobs[job.id] = job
+    
+    def _enqueue(self, job):
+        """Поставить зарегистрированную задачу в кучу и разбудить рабочий поток"""
+        with self._cond:
+            if job.status != JOB_QUEUED:
+                return  # Отменена до постановки в очередь
+            heapq.heappush(self._heap, (-job.priority, next(self._counter), job.id))
+            self._cond.notify()
+    
+    def cancel(self, job_id):
+        """Отменить задачу (ожидающая снимается сразу, выполняющаяся - на ближайшем шаге)"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in (JOB_QUEUED, JOB_RUNNING):
+                return False
+            job._cancel.set()
+            queued = job.status == JOB_QUEUED
+            if queued:
+                job.status = JOB_CANCELLED
+        
+        if queued:
+            self._save_state()
+            self._emit(job, JOB_CANCELLED)
+        return True
+    
+    def get(self, job_id):
+        """Задача по идентификатору"""
+        with self._cond:
+            return self._jobs.get(job_id)
+    
+    def jobs(self):
+        """Все задачи текущего сеанса"""
+        with self._cond:
+            return list(self._jobs.values())
+    
+    def _next_job(self):
+        """Ожидающая задача с наибольшим приоритетом (None при остановке)"""
+        with self._cond:
+            while self._running:
+                while self._heap:
+                    _, _, job_id = heapq.heappop(self._heap)
+                    job = self._jobs[job_id]
+                    if job.status == JOB_QUEUED:
+                        job.status = JOB_RUNNING
+                        return job
+                self._cond.wait()
+            return None
+    
+    def _worker(self):
+        """Рабочий поток: задачи выполняются по одной"""
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            self._emit(job, JOB_RUNNING)
+            self._run_job(job)
+            if self._running:
+                # При остановке прерванная задача остается в сохраненной очереди
+                self._save_state()
+            self._emit(job, job.status)
+    
+    def _run_job(self, job):
+        """Выполнение анализа с прогрессом и проверкой отмены"""
+        # Тяжелые модули импортируются при первом анализе
+        from analyse_service import merge_transcription_diarization
+        from model_manager import ModelManager
+        
+        def cancel_check():
+            if job.cancel_requested:
+                raise JobCancelled()
+        
+        def progress_callback(stage, progress, message):
+            cancel_check()
+            job.stage, job.progress, job.message = stage, progress, message
+            self._emit(job, "progress")
+        
+        try:
+            if not ModelManager().is_loaded():
+                progress_callback("Загрузка", 0.05, "Ожидание загрузки модели распознавания...")
+            ModelManager().wait_until_ready()
+            progress_callback("Загрузка", 0.1, "Подготовка к анализу...")
+            
+            job.result = merge_transcription_diarization(job.audio_path, job.n_speakers, progress_callback,
+                                                         cache=self.cache, cancel_check=cancel_check,
+                                                         **job.options)
+            if job.cancel_requested:
+                raise JobCancelled()
+            job.progress = 1.0
+            job.status = JOB_DONE
+        except JobCancelled:
+            job.status = JOB_CANCELLED
+        except Exception as e:
+            job.error = e
+            job.status = JOB_FAILED
+    
+    def _load_state(self):
+        """Незавершенные задачи прошлого сеанса"""
+        if self.state_path is None:
+            return []
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return [AnalysisJob.from_dict(item) for item in payload if os.path.exists(item["audio_path"])]
+    
+    def _save_state(self):
+        """Сохранить ожидающие и выполняющиеся задачи (через временный файл)"""
+        if self.state_path is None:
+            return
+        with self._cond:
+            pending = [job.to_dict() for job in self._jobs.values() if job.status in (JOB_QUEUED, JOB_RUNNING)]
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = f"{self.state_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(pending, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+    
+    def shutdown(self, wait=False):
+        """Остановить рабочие потоки (текущие задачи отменяются, очередь остается на диске)"""
+        self._save_state()
+        with self._cond:
+            self._running = False
+            running = [job for job in self._jobs.values() if job.status == JOB_RUNNING]
+            self._cond.notify_all()
+        for job in running:
+            job._cancel.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
@@ -1,11 +1,27 @@
+import time
+_START_TIME = time.perf_counter()  # Отсчет холодного старта
+
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
 import threading
+import importlib
+import os
 from datetime import datetime
-from analyse_service import merge_transcription_diarization
+from cache_service import AnalysisCache
 from statistics_service import calculate_statistics
-from recorder_window import RecorderWindow
-from model_manager import ModelManager
+from model_manager import ModelManager, SMALL_MODEL_PATH, default_workers
+from job_queue_service import AnalysisJobQueue, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED
+
+# Совпадает с dyarise_service.AUTO_SPEAKERS: сам модуль (librosa, sklearn, scipy) импортируется лениво
+AUTO_SPEAKERS = "auto"
+
+# Тяжелые модули анализа и диктофона импортируются в фоне после показа окна
+HEAVY_MODULES = ("analyse_service", "recorder_window")
+
+
+def lazy_import(name):
+    """Модуль по имени (импортируется при первом обращении)"""
+    return importlib.import_module(name)
 
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
@@ -94,8 +110,17 @@ class AudioAnalyzerGUI:
         self.audio_files = {}
         self.current_file = None
         self.meeting_counter = 0
+        self.analysis_cache = AnalysisCache()
+        self.recorder_pending = False
+        
+        # Анализы выполняются через очередь: не больше одного тяжелого анализа одновременно
+        self.job_queue = AnalysisJobQueue(workers=1, cache=self.analysis_cache)
+        self.job_queue.add_listener(lambda job, event: self.root.after(0, lambda: self.on_job_event(job, event)))
         
         self.create_widgets()
+        self.warm_up()
+        self.job_queue.start()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
     
     def create_widgets(self):
         """Создание виджетов интерфейса"""
@@ -126,7 +151,7 @@ class AudioAnalyzerGUI:
         
         ctk.CTkLabel(top_frame, text="Спикеров:", 
                     font=("Segoe UI", 13), text_color="#f0f0f0").pack(side="left", padx=(20, 5))
-        self.speakers_var = ctk.StringVar(value="2")
+        self.speakers_var = ctk.StringVar(value="2")  # "авто" - автоопределение
         ctk.CTkEntry(top_frame, textvariable=self.speakers_var, width=60,
                     font=("Segoe UI", 13), corner_radius=15).pack(side="left", padx=5)
         
@@ -135,6 +160,11 @@ class AudioAnalyzerGUI:
                      font=("Segoe UI", 13, "bold"), corner_radius=25,
                      height=40, width=180).pack(side="left", padx=5)
         
+        ctk.CTkButton(top_frame, text="⏹ Отменить", command=self.cancel_analysis,
+                     fg_color="#6c757d", hover_color="#495057",
+                     font=("Segoe UI", 13, "bold"), corner_radius=25,
+                     height=40, width=120).pack(side="left", padx=5)
+        
         ctk.CTkButton(top_frame, text="💾 Сохранить", command=self.save_result,
                      fg_color="#c77dff", hover_color="#9d4edd",
                      font=("Segoe UI", 13, "bold"), corner_radius=25,
@@ -195,12 +225,81 @@ class AudioAnalyzerGUI:
                                         anchor="w")
         self.status_label.pack(fill="x", padx=20, pady=(0, 10))
     
+    def warm_up(self):
+        """Фоновая загрузка модели и тяжелых модулей, пока окно уже доступно"""
+        self.status_label.configure(text="⏳ Модель распознавания загружается в фоне...")
+        for model_path in self.recorder_models():
+            ModelManager().preload(model_path)
+        
+        def run():
+            """Импорт модулей и ожидание модели (в отдельном потоке)"""
+            started = time.perf_counter()
+            for name in HEAVY_MODULES:
+                try:
+                    lazy_import(name)
+                except Exception as e:
+                    print(f"❌ Ошибка импорта {name}: {e}")
+            imports_sec = time.perf_counter() - started
+            try:
+                ModelManager().wait_until_ready()
+            except Exception as e:
+                self.root.after(0, lambda error=e: self.on_model_failed(error))
+                return
+            total_sec = time.perf_counter() - _START_TIME
+            print(f"📦 Модули анализа импортированы за {imports_sec:.1f} с, "
+                  f"модель готова через {total_sec:.1f} с после запуска")
+            self.root.after(0, lambda: self.status_label.configure(
+                text=f"✅ Готов к работе (модель загружена за {total_sec:.1f} с)"
+            ))
+        
+        threading.Thread(target=run, daemon=True).start()
+    
+    def on_model_failed(self, error):
+        """Сообщение об ошибке фоновой загрузки модели"""
+        self.status_label.configure(text="❌ Модель распознавания не загружена")
+        messagebox.showerror(
+            "Ошибка загрузки модели",
+            f"Не удалось загрузить модель распознавания речи:\n\n{str(error)}\n\n"
+            f"Убедитесь, что папка '{ModelManager().get_model_path()}' находится в директории проекта."
+        )
+    
+    def recorder_models(self):
+        """Модели диктофона: большая для уточнения и малая для живого текста (если установлена)"""
+        return [None, SMALL_MODEL_PATH] if os.path.exists(SMALL_MODEL_PATH) else [None]
+    
     def open_recorder(self):
-        """Открыть окно диктофона"""
-        RecorderWindow(self.root, on_recording_saved=self.on_recording_saved)
+        """Открыть окно диктофона (если модели еще загружаются - после их готовности)"""
+        if all(ModelManager().is_loaded(model_path) for model_path in self.recorder_models()):
+            recorder_window = lazy_import("recorder_window")
+            recorder_window.RecorderWindow(self.root, on_recording_saved=self.on_recording_saved)
+            return
+        
+        if self.recorder_pending:
+            return
+        self.recorder_pending = True
+        self.status_label.configure(text="⏳ Диктофон откроется после загрузки модели...")
+        
+        def wait_model():
+            """Ожидание модели (в отдельном потоке)"""
+            try:
+                for model_path in self.recorder_models():
+                    ModelManager().wait_until_ready(model_path)
+                lazy_import("recorder_window")
+            except Exception as e:
+                self.root.after(0, lambda error=e: self.on_model_failed(error))
+                return
+            finally:
+                self.recorder_pending = False
+            self.root.after(0, self.open_recorder)
+        
+        threading.Thread(target=wait_model, daemon=True).start()
     
-    def on_recording_saved(self, audio_file):
-        """Обработка сохраненной записи из диктофона"""
+    def on_recording_saved(self, audio_file, diarization=None, transcription=None):
+        """Обработка сохраненной записи из диктофона
+        
+        diarization - спикеры, определенные при записи,
+        transcription - сегменты, распознанные при записи (тогда диалог собирается без полного анализа).
+        """
         if audio_file and audio_file not in self.audio_files:
             self.meeting_counter += 1
             date_str = datetime.now().strftime("%d.%m.%Y %H:%M")
@@ -209,7 +308,8 @@ class AudioAnalyzerGUI:
             self.audio_files[audio_file] = {
                 'display_name': display_name,
                 'dialogue': None,
-                'diarization': None
+                'diarization': None,
+                'live_diarization': diarization
             }
             self.file_listbox.insert("end", display_name)
             
@@ -218,9 +318,30 @@ class AudioAnalyzerGUI:
             self.file_listbox.selection_set("end")
             self.current_file = audio_file
             
+            # Пустая транскрибация (VAD не нашел речь) - обычный путь через полный анализ
+            if transcription and diarization is not None:
+                self.merge_recorded_analysis(audio_file, transcription, diarization)
+            else:
+                self.restore_cached_results([audio_file])
+            
             self.status_label.configure(text=f"✅ Запись добавлена: {display_name}")
             messagebox.showinfo("Успех", "Запись сохранена и добавлена в список.\nТеперь вы можете её анализировать!")
     
+    def merge_recorded_analysis(self, audio_file, transcription, diarization):
+        """Диалог из результатов, полученных во время записи (в отдельном потоке)"""
+        def merge():
+            """Объединение сегментов и онлайн-диаризации"""
+            try:
+                result = lazy_import("analyse_service").merge_recorded_segments(transcription, diarization)
+            except Exception as e:
+                print(f"Ошибка объединения результатов записи: {e}")
+                return
+            self.root.after(0, lambda: self.apply_cached_result(
+                audio_file, result, status="⚡ Диалог собран во время записи"
+            ))
+        
+        threading.Thread(target=merge, daemon=True).start()
+    
     def load_audio(self):
         """Загрузка аудиофайлов"""
         files = filedialog.askopenfilenames(
@@ -228,8 +349,10 @@ class AudioAnalyzerGUI:
             filetypes=[("Audio files", "*.mp3 *.wav *.m4a"), ("All files", "*.*")]
         )
         
+        new_files = []
         for file_path in files:
             if file_path not in self.audio_files:
+                new_files.append(file_path)
                 self.meeting_counter += 1
                 date_str = datetime.now().strftime("%d.%m.%Y")
                 display_name = f"Встреча №{self.meeting_counter} от {date_str}"
@@ -241,8 +364,40 @@ class AudioAnalyzerGUI:
                 }
                 self.file_listbox.insert("end", display_name)
         
+        self.restore_cached_results(new_files)
         self.status_label.configure(text=f"✅ Загружено файлов: {len(self.audio_files)}")
     
+    def restore_cached_results(self, file_paths):
+        """Подгрузка результатов уже проанализированных файлов из кэша (в отдельном потоке)"""
+        n_speakers = self.get_n_speakers()
+        if n_speakers is None:
+            return
+        
+        def lookup():
+            """Хэширование файлов и поиск в кэше"""
+            for file_path in file_paths:
+                try:
+                    cached = lazy_import("analyse_service").load_cached_analysis(
+                        file_path, n_speakers, self.analysis_cache
+                    )
+                except OSError:
+                    continue
+                if cached is not None:
+                    self.root.after(0, lambda path=file_path, result=cached: self.apply_cached_result(path, result))
+        
+        threading.Thread(target=lookup, daemon=True).start()
+    
+    def apply_cached_result(self, file_path, result, status="⚡ Результат из кэша"):
+        """Применение готового результата (в главном потоке)"""
+        file_data = self.audio_files.get(file_path)
+        if file_data is None or file_data.get('dialogue'):
+            return
+        
+        file_data['dialogue'], file_data['diarization'] = result
+        if file_path == self.current_file:
+            self.display_result(file_data['dialogue'])
+        self.status_label.configure(text=f"{status}: {file_data['display_name']}")
+    
     def on_file_select(self, event):
         """Обработка выбора файла из списка"""
         selection = self.file_listbox.curselection()
@@ -251,8 +406,11 @@ class AudioAnalyzerGUI:
             self.current_file = list(self.audio_files.keys())[idx]
             
             file_data = self.audio_files[self.current_file]
+            job = file_data.get('job')
             if file_data.get('dialogue'):
                 self.display_result(file_data['dialogue'])
+            elif job is not None and job.status in (JOB_QUEUED, JOB_RUNNING):
+                self.update_progress(job.stage or "Загрузка", job.progress, job.message or "В очереди на анализ...")
             else:
                 self.result_text.delete("0.0", "end")
                 self.result_text.insert("0.0", "📌 Файл еще не проанализирован.\nНажмите '▶️ Анализировать' для начала обработки.")
@@ -280,49 +438,99 @@ class AudioAnalyzerGUI:
         display_text += f"\n{message}"
         self.result_text.insert("0.0", display_text)
     
+    def get_n_speakers(self):
+        """Количество спикеров из поля ввода (AUTO_SPEAKERS для автоопределения, None при ошибке)"""
+        value = self.speakers_var.get().strip().lower()
+        if value in ("auto", "авто", "0"):
+            return AUTO_SPEAKERS
+        try:
+            n_speakers = int(value)
+        except ValueError:
+            return None
+        return n_speakers if n_speakers > 0 else None
+    
     def analyze_audio(self):
         """Запуск анализа выбранного аудиофайла"""
         if not self.current_file:
             messagebox.showwarning("Предупреждение", "Выберите файл для анализа")
             return
         
-        try:
-            n_speakers = int(self.speakers_var.get())
-        except ValueError:
-            messagebox.showerror("Ошибка", "Введите корректное количество спикеров")
+        n_speakers = self.get_n_speakers()
+        if n_speakers is None:
+            messagebox.showerror("Ошибка", "Введите количество спикеров или 'авто'")
             return
         
-        # Показываем прогресс бар
-        self.progress_bar.pack(fill="x", padx=20, pady=(0, 5), before=self.status_label)
-        self.progress_bar.set(0)
+        file_data = self.audio_files[self.current_file]
+        job = file_data.get('job')
+        if job is not None and job.status in (JOB_QUEUED, JOB_RUNNING):
+            messagebox.showinfo("Анализ", "Файл уже в очереди анализа")
+            return
         
-        self.root.after(0, lambda: self.update_progress("Загрузка", 0.1, "Подготовка к анализу..."))
+        # Спикеры, определенные во время записи, переиспользуются в режиме "авто"
+        # Транскрибация по кускам в пуле процессов по ядрам и свободной памяти
+        options = {'parallel': True, 'workers': default_workers(ModelManager().get_model_path())}
+        if n_speakers == AUTO_SPEAKERS and file_data.get('live_diarization') is not None:
+            options['diarization'] = file_data['live_diarization']
         
-        def run_analysis():
-            """Выполнение анализа в отдельном потоке"""
-            try:
-                # Callback для обновления прогресса
-                def progress_callback(stage, progress, message):
-                    self.root.after(0, lambda: self.update_progress(stage, progress, message))
-                
-                dialogue, diarization = merge_transcription_diarization(
-                    self.current_file, n_speakers, progress_callback
-                )
-                file_data = self.audio_files[self.current_file]
-                file_data['dialogue'] = dialogue
-                file_data['diarization'] = diarization
-                
-                self.root.after(0, lambda: self.progress_bar.set(1.0))
-                self.root.after(0, lambda: self.display_result(dialogue))
-                self.root.after(0, lambda: self.status_label.configure(text="✅ Анализ завершен успешно!"))
+        # Файл, запущенный вручную, обгоняет восстановленные из прошлого сеанса задачи
+        file_data['job'] = self.job_queue.submit(self.current_file, n_speakers, priority=1, **options)
+    
+    def cancel_analysis(self):
+        """Отмена анализа выбранного файла"""
+        file_data = self.audio_files.get(self.current_file)
+        job = file_data.get('job') if file_data else None
+        if job is None or not self.job_queue.cancel(job.id):
+            messagebox.showinfo("Отмена", "Для выбранного файла нет анализа в очереди")
+            return
+        self.status_label.configure(text="⏹ Отмена анализа...")
+    
+    def on_job_event(self, job, event):
+        """События очереди анализа (в главном потоке)"""
+        file_data = self.audio_files.get(job.audio_path)
+        if file_data is None:
+            # Задача восстановлена из прошлого сеанса - файл возвращается в список
+            self.meeting_counter += 1
+            display_name = f"Встреча №{self.meeting_counter} (из очереди)"
+            file_data = self.audio_files[job.audio_path] = {
+                'display_name': display_name,
+                'dialogue': None,
+                'diarization': None
+            }
+            self.file_listbox.insert("end", display_name)
+        file_data['job'] = job
+        is_current = job.audio_path == self.current_file
+        
+        if event == JOB_QUEUED:
+            # Запоздавшее событие для уже запущенной или завершенной задачи не сбрасывает прогресс
+            if is_current and job.status == JOB_QUEUED:
+                self.progress_bar.pack(fill="x", padx=20, pady=(0, 5), before=self.status_label)
+                self.update_progress("Загрузка", 0.0, "В очереди на анализ...")
+        elif event == "progress":
+            if is_current:
+                self.update_progress(job.stage, job.progress, job.message)
+        elif event == JOB_DONE:
+            file_data['dialogue'], file_data['diarization'] = job.result
+            if is_current:
+                self.progress_bar.set(1.0)
+                self.display_result(file_data['dialogue'])
                 self.root.after(1000, lambda: self.progress_bar.pack_forget())  # Скрываем через 1 сек
-            except Exception as e:
-                self.root.after(0, lambda: self.progress_bar.pack_forget())
-                self.root.after(0, lambda: messagebox.showerror("Ошибка", f"Ошибка анализа: {str(e)}"))
-                self.root.after(0, lambda: self.status_label.configure(text="❌ Ошибка анализа"))
-        
-        thread = threading.Thread(target=run_analysis)
-        thread.start()
+            self.status_label.configure(text=f"✅ Анализ завершен успешно: {file_data['display_name']}")
+        elif event == JOB_FAILED:
+            if is_current:
+                self.progress_bar.pack_forget()
+            self.status_label.configure(text="❌ Ошибка анализа")
+            messagebox.showerror("Ошибка", f"Ошибка анализа ({file_data['display_name']}): {str(job.error)}")
+        elif event == JOB_CANCELLED:
+            if is_current:
+                self.progress_bar.pack_forget()
+                self.result_text.delete("0.0", "end")
+                self.result_text.insert("0.0", "⏹ Анализ отменен.\nНажмите '▶️ Анализировать', чтобы запустить снова.")
+            self.status_label.configure(text=f"⏹ Анализ отменен: {file_data['display_name']}")
+    
+    def on_closing(self):
+        """Закрытие приложения: незавершенные анализы остаются в очереди до следующего запуска"""
+        self.job_queue.shutdown()
+        self.root.destroy()
     
     def display_result(self, dialogue):
         """Отображение результата анализа"""
@@ -383,68 +591,17 @@ class AudioAnalyzerGUI:
 
 def main():
     """Запуск приложения"""
-    # Создаем окно загрузки
-    splash = ctk.CTk()
-    splash.title("ОТКЛИК")
-    splash.geometry("400x200")
-    splash.configure(fg_color="#0a0e27")
-    
-    # Центрируем окно
-    splash.update_idletasks()
-    screen_width = splash.winfo_screenwidth()
-    screen_height = splash.winfo_screenheight()
-    x = (screen_width - 400) // 2
-    y = (screen_height - 200) // 2
-    splash.geometry(f"400x200+{x}+{y}")
-    
-    # Содержимое окна загрузки
-    ctk.CTkLabel(splash, text="🎙️ ОТКЛИК", 
-                font=("Segoe UI", 32, "bold"), 
-                text_color="#f0f0f0").pack(pady=(30, 20))
-    
-    status_label = ctk.CTkLabel(splash, text="⏳ Загрузка модели распознавания...", 
-                                font=("Segoe UI", 12), 
-                                text_color="#f0f0f0")
-    status_label.pack(pady=10)
-    
-    progress = ctk.CTkProgressBar(splash, mode="indeterminate", 
-                                  progress_color="#9d4edd",
-                                  width=300)
-    progress.pack(pady=10)
-    progress.start()
-    
-    def load_model():
-        """Загрузка модели в отдельном потоке"""
-        try:
-            # Предзагрузка модели
-            model_manager = ModelManager()
-            model_manager.get_model()
-            
-            # Закрываем окно загрузки и запускаем основное приложение
-            splash.after(0, lambda: status_label.configure(text="✅ Модель загружена!"))
-            splash.after(500, lambda: start_main_app(splash))
-        except Exception as e:
-            splash.after(0, lambda: messagebox.showerror(
-                "Ошибка загрузки модели",
-                f"Не удалось загрузить модель распознавания речи:\n\n{str(e)}\n\n"
-                f"Убедитесь, что папка 'vosk-model-ru-0.42' находится в директории проекта."
-            ))
-            splash.after(0, lambda: splash.destroy())
-    
-    def start_main_app(splash_window):
-        """Запуск основного приложения"""
-        splash_window.destroy()
-        
-        root = ctk.CTk()
-        root.configure(fg_color="#0a0e27")
-        app = AudioAnalyzerGUI(root)
-        root.mainloop()
+    # Окно открывается сразу, модель и модули анализа загружаются в фоне
+    root = ctk.CTk()
+    root.configure(fg_color="#0a0e27")
+    app = AudioAnalyzerGUI(root)
     
-    # Запускаем загрузку модели в отдельном потоке
-    loading_thread = threading.Thread(target=load_model)
-    loading_thread.start()
+    def report_startup():
+        """Время до первого отклика интерфейса"""
+        print(f"🚀 Окно доступно через {time.perf_counter() - _START_TIME:.2f} с после запуска")
     
-    splash.mainloop()
+    root.after_idle(report_startup)
+    root.mainloop()
 
 
 if __name__ == "__main__":
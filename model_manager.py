@@ -1,35 +1,317 @@
 import os
-from vosk import Model
+import threading
+import time
+from contextlib import contextmanager
+from vosk import Model, KaldiRecognizer
+
+# Большая модель - для итогового анализа, малая - для быстрого предпросмотра при записи
+LARGE_MODEL_PATH = "vosk-model-ru-0.42"
+SMALL_MODEL_PATH = "vosk-model-small-ru-0.22"
+
+# Память на воркер сверх модели: декодированное аудио, признаки, GMM
+WORKER_OVERHEAD_BYTES = 1024 * 1024 * 1024
+
+
+def directory_size(path):
+    """Размер каталога модели на диске (оценка памяти, которую она займет)"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _physical_memory():
+    """Объем оперативной памяти (None, если определить нельзя)"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def available_memory():
+    """Доступная оперативная память в байтах (None, если определить нельзя)"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_workers(model_path=None, concurrent=1):
+    """Число воркеров по ядрам и памяти (каждый воркер держит свою копию модели).
+    
+    concurrent - сколько анализов идет одновременно: ядра и память делятся между ними.
+    """
+    workers = os.cpu_count() or 1
+    memory = available_memory()
+    if memory is not None:
+        per_worker = directory_size(model_path or LARGE_MODEL_PATH) + WORKER_OVERHEAD_BYTES
+        workers = min(workers, memory // per_worker)
+    return max(1, workers // max(1, concurrent))
+
+
+class RecognizerPool:
+    """Пул переиспользуемых KaldiRecognizer одной модели и частоты дискретизации"""
+    
+    def __init__(self, model, sample_rate, max_idle=4):
+        """Инициализация пула (max_idle - сколько свободных распознавателей хранить)"""
+        self.model = model
+        self.sample_rate = sample_rate
+        self.max_idle = max_idle
+        self.in_use = 0
+        self._idle = []
+        self._lock = threading.Lock()
+    
+    def acquire(self, words=True):
+        """Свободный распознаватель (сброшенный) или новый"""
+        with self._lock:
+            recognizer = self._idle.pop() if self._idle else None
+            self.in_use += 1
+        if recognizer is None:
+            recognizer = KaldiRecognizer(self.model, self.sample_rate)
+        else:
+            recognizer.Reset()
+        recognizer.SetWords(words)
+        return recognizer
+    
+    def release(self, recognizer):
+        """Вернуть распознаватель в пул"""
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+            if len(self._idle) < self.max_idle:
+                self._idle.append(recognizer)
+    
+    def discard(self, recognizer):
+        """Не возвращать распознаватель в пул (например, им еще пользуется зависший поток)"""
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+    
+    def clear(self):
+        """Освободить свободные распознаватели"""
+        with self._lock:
+            self._idle = []
+
+
+class _ModelEntry:
+    """Состояние одной модели в реестре"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.model = None
+        self.error = None
+        self.size_bytes = 0
+        self.last_used = time.time()
+        self.pools = {}  # sample_rate -> RecognizerPool
+        self.ready = threading.Event()  # Установлен, когда загрузка завершилась (успешно или с ошибкой)
+        self.lock = threading.Lock()
+        self.preload_thread = None
+    
+    @property
+    def in_use(self):
+        return sum(pool.in_use for pool in self.pools.values())
 
 
 class ModelManager:
-    """Singleton менеджер для управления моделями Vosk"""
+    """Singleton реестр моделей Vosk с пулами распознавателей.
+    
+    Модели загружаются по требованию (каждая под своей блокировкой). Неиспользуемые
+    модели выгружаются после простоя (фоновый поток проверяет их раз в sweep_interval_sec)
+    и при загрузке новой модели, если суммарный размер превысил бюджет памяти.
+    Вызовы без model_path относятся к модели по умолчанию (большой).
+    """
     
     _instance = None
-    _model = None
-    _model_path = "vosk-model-ru-0.42"
+    _model_path = LARGE_MODEL_PATH
+    _entries = {}
+    _owners = {}  # id распознавателя -> пул, из которого он выдан
+    _registry_lock = threading.Lock()
+    # Бюджет памяти на модели: по умолчанию половина оперативной памяти
+    memory_budget_bytes = (_physical_memory() or 8 * 1024 ** 3) // 2
+    idle_unload_sec = 600
+    # Как часто фоновый поток проверяет простаивающие модели
+    sweep_interval_sec = 60
+    _sweeper = None
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(ModelManager, cls).__new__(cls)
         return cls._instance
     
-    def get_model(self):
+    def _entry(self, model_path=None):
+        """Запись реестра для модели (создается при первом обращении)"""
+        model_path = model_path or self._model_path
+        with self._registry_lock:
+            if model_path not in self._entries:
+                self._entries[model_path] = _ModelEntry(model_path)
+            return self._entries[model_path]
+    
+    def get_model(self, model_path=None):
         """Получить модель (загружается только один раз)"""
-        if self._model is None:
-            if not os.path.exists(self._model_path):
+        entry = self._entry(model_path)
+        with entry.lock:
+            if entry.model is None:
+                self._load(entry)
+            entry.last_used = time.time()
+            return entry.model
+    
+    def _load(self, entry):
+        """Загрузка модели (под блокировкой записи)"""
+        try:
+            if not os.path.exists(entry.path):
                 raise FileNotFoundError(
-                    f"Модель не найдена по пути: {self._model_path}\n"
+                    f"Модель не найдена по пути: {entry.path}\n"
                     f"Скачайте модель с https://alphacephei.com/vosk/models и распакуйте в папку проекта"
                 )
             
-            print(f"⏳ Загрузка модели из {self._model_path}...")
-            self._model = Model(self._model_path)
-            print("✅ Модель загружена!")
+            # Перед загрузкой освобождаем место под новую модель
+            entry.size_bytes = directory_size(entry.path)
+            self.unload_idle(reserve_bytes=entry.size_bytes)
+            
+            print(f"⏳ Загрузка модели из {entry.path}...")
+            started = time.perf_counter()
+            entry.model = Model(entry.path)
+            entry.error = None
+            print(f"✅ Модель загружена за {time.perf_counter() - started:.1f} с!")
+            self._start_sweeper()
+        except Exception as e:
+            entry.error = e
+            raise
+        finally:
+            entry.ready.set()
+    
+    def _start_sweeper(self):
+        """Запустить фоновую выгрузку простаивающих моделей (один поток на процесс)"""
+        with self._registry_lock:
+            if ModelManager._sweeper is not None:
+                return
+            ModelManager._sweeper = threading.Thread(target=self._sweep, daemon=True)
+            ModelManager._sweeper.start()
+    
+    def _sweep(self):
+        while True:
+            time.sleep(self.sweep_interval_sec)
+            try:
+                self.unload_idle()
+            except Exception as e:
+                print(f"Ошибка выгрузки моделей: {e}")
+    
+    def preload(self, model_path=None):
+        """Начать загрузку модели в фоновом потоке (повторные вызовы ничего не делают)"""
+        entry = self._entry(model_path)
+        with entry.lock:
+            if entry.model is not None or entry.preload_thread is not None:
+                return
+            entry.ready.clear()
+            entry.preload_thread = threading.Thread(target=self._preload, args=(entry,), daemon=True)
+            entry.preload_thread.start()
+    
+    def _preload(self, entry):
+        try:
+            self.get_model(entry.path)
+        except Exception as e:
+            print(f"❌ Ошибка загрузки модели: {e}")
+        finally:
+            entry.preload_thread = None
+    
+    @property
+    def ready_event(self):
+        """Событие готовности модели по умолчанию (для ожидания без блокировки загрузки)"""
+        return self._entry().ready
+    
+    def wait_until_ready(self, model_path=None, timeout=None):
+        """Дождаться фоновой загрузки и вернуть модель (ошибка загрузки пробрасывается)"""
+        entry = self._entry(model_path)
+        self.preload(model_path)
+        if not entry.ready.wait(timeout):
+            raise TimeoutError("Модель распознавания еще загружается")
+        if entry.model is None and entry.error is not None:
+            raise entry.error
+        return self.get_model(model_path)
+    
+    def acquire_recognizer(self, sample_rate=16000, model_path=None, words=True):
+        """Распознаватель из пула модели (вернуть через release_recognizer)"""
+        entry = self._entry(model_path)
+        with entry.lock:
+            if entry.model is None:
+                self._load(entry)
+            entry.last_used = time.time()
+            pool = entry.pools.get(sample_rate)
+            if pool is None:
+                pool = entry.pools[sample_rate] = RecognizerPool(entry.model, sample_rate)
+            # Счетчик занятых увеличивается под блокировкой, чтобы модель не выгрузили
+            recognizer = pool.acquire(words)
+        
+        with self._registry_lock:
+            self._owners[id(recognizer)] = pool
+        return recognizer
+    
+    def release_recognizer(self, recognizer):
+        """Вернуть распознаватель в пул его модели"""
+        with self._registry_lock:
+            pool = self._owners.pop(id(recognizer), None)
+        if pool is not None:
+            pool.release(recognizer)
+    
+    def discard_recognizer(self, recognizer):
+        """Освободить место распознавателя в пуле, не возвращая его для повторной выдачи"""
+        with self._registry_lock:
+            pool = self._owners.pop(id(recognizer), None)
+        if pool is not None:
+            pool.discard(recognizer)
+    
+    @contextmanager
+    def recognizer(self, sample_rate=16000, model_path=None, words=True):
+        """Распознаватель из пула на время блока with"""
+        recognizer = self.acquire_recognizer(sample_rate, model_path, words)
+        try:
+            yield recognizer
+        finally:
+            self.release_recognizer(recognizer)
+    
+    def unload(self, model_path=None):
+        """Выгрузить модель, если она не загружается и ее распознаватели свободны (True при выгрузке)"""
+        entry = self._entry(model_path)
+        # Не ждем блокировку: занятая модель (идет загрузка или выдача) не выгружается
+        if not entry.lock.acquire(blocking=False):
+            return False
+        try:
+            if entry.model is None or entry.in_use:
+                return False
+            for pool in entry.pools.values():
+                pool.clear()
+            entry.pools = {}
+            entry.model = None
+            entry.ready.clear()
+        finally:
+            entry.lock.release()
+        print(f"🧹 Модель выгружена: {entry.path}")
+        return True
+    
+    def unload_idle(self, idle_sec=None, reserve_bytes=0):
+        """Выгрузить простаивающие дольше idle_sec модели, а также самые давние,
+        пока загруженные модели (плюс reserve_bytes) не уложатся в бюджет памяти
+        """
+        idle_sec = self.idle_unload_sec if idle_sec is None else idle_sec
+        with self._registry_lock:
+            loaded = sorted(
+                (entry for entry in self._entries.values() if entry.model is not None),
+                key=lambda entry: entry.last_used
+            )
         
-        return self._model
+        total = sum(entry.size_bytes for entry in loaded) + reserve_bytes
+        now = time.time()
+        for entry in loaded:
+            over_budget = total > self.memory_budget_bytes
+            if (over_budget or now - entry.last_used > idle_sec) and self.unload(entry.path):
+                total -= entry.size_bytes
     
-    def is_loaded(self):
+    def get_model_path(self, model_path=None):
+        """Путь к модели (для загрузки в отдельных процессах)"""
+        return model_path or self._model_path
+    
+    def is_loaded(self, model_path=None):
         """Проверить, загружена ли модель"""
-        return self._model is not None
-
+        return self._entry(model_path).model is not None
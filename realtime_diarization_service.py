@@ -0,0 +1,108 @@
+import threading
+import numpy as np
+import librosa
+from dyarise_service import SpeakerTimeline
+
+
+class OnlineDiarizer:
+    """Диаризация в реальном времени по потоку PCM (те же окна MFCC, что и в офлайн-диаризации)"""
+    
+    def __init__(self, sample_rate=16000, window_sec=1.0, hop_sec=0.5, max_speakers=4,
+                 new_speaker_distance=7.0, silence_threshold=500, warmup_windows=10):
+        """Инициализация диаризатора"""
+        self.sample_rate = sample_rate
+        self.window = int(window_sec * sample_rate)
+        self.hop = int(hop_sec * sample_rate)
+        self.hop_sec = hop_sec
+        self.max_speakers = max_speakers
+        # Расстояние (в единицах текущего СКО признаков), дальше которого заводится новый спикер.
+        # Для окон одного спикера квадрат расстояния по 13 MFCC распределен примерно как хи-квадрат
+        # с 13 степенями свободы, 7.0 - его квантиль ~0.9999, поэтому ложные спикеры не заводятся
+        self.new_speaker_distance = new_speaker_distance
+        # Пока речевых окон меньше, оценка СКО вырождена, и новые спикеры не заводятся
+        self.warmup_windows = warmup_windows
+        # Порог тишины по RMS окна в единицах int16
+        self.silence_threshold = silence_threshold / 32768
+        
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """Сбросить состояние перед новой записью"""
+        with self._lock:
+            self._buffer = np.zeros(0, dtype=np.float32)
+            self.frame_labels = []
+            
+            # Скользящие среднее и дисперсия признаков (Welford)
+            self._count = 0
+            self._mean = np.zeros(13)
+            self._m2 = np.zeros(13)
+            
+            # Модель спикеров: центроиды в исходном пространстве MFCC и число кадров
+            self._centroids = []
+            self._counts = []
+    
+    def feed(self, data):
+        """Принять очередной кусок PCM int16 (bytes) и разметить готовые окна"""
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768
+        with self._lock:
+            self._buffer = np.concatenate((self._buffer, samples))
+            if len(self._buffer) < self.window:
+                return
+            
+            # Все готовые окна считаются одним вызовом MFCC
+            n_frames = 1 + (len(self._buffer) - self.window) // self.hop
+            used = (n_frames - 1) * self.hop + self.window
+            mfcc = librosa.feature.mfcc(y=self._buffer[:used], sr=self.sample_rate, n_mfcc=13,
+                                        n_fft=self.window, hop_length=self.hop, center=False)
+            frames = np.lib.stride_tricks.sliding_window_view(self._buffer[:used], self.window)[::self.hop]
+            rms = np.sqrt(np.mean(frames ** 2, axis=1))
+            
+            for features, level in zip(mfcc.T.astype(np.float64), rms):
+                self.frame_labels.append(self._assign(features) if level >= self.silence_threshold else -1)
+            
+            self._buffer = self._buffer[n_frames * self.hop:]
+    
+    def _assign(self, features):
+        """Отнести окно к ближайшему спикеру или завести нового"""
+        self._count += 1
+        delta = features - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (features - self._mean)
+        
+        if not self._centroids:
+            self._centroids.append(features.copy())
+            self._counts.append(1)
+            return 0
+        
+        std = np.sqrt(self._m2 / max(self._count - 1, 1)) + 1e-8
+        distances = np.linalg.norm((np.array(self._centroids) - features) / std, axis=1)
+        speaker = int(np.argmin(distances))
+        
+        if (self._count > self.warmup_windows and distances[speaker] > self.new_speaker_distance
+                and len(self._centroids) < self.max_speakers):
+            self._centroids.append(features.copy())
+            self._counts.append(1)
+            return len(self._centroids) - 1
+        
+        # Инкрементальное обновление центроида
+        self._counts[speaker] += 1
+        self._centroids[speaker] += (features - self._centroids[speaker]) / self._counts[speaker]
+        return speaker
+    
+    def get_timeline(self, min_segment_sec=1.0):
+        """Текущая диаризация в виде SpeakerTimeline"""
+        with self._lock:
+            labels = list(self.frame_labels)
+            n_speakers = len(self._centroids)
+        label_table = [f"Speaker_{label}" for label in range(n_speakers)]
+        return SpeakerTimeline.from_frame_labels(labels, self.hop_sec, label_table, min_segment_sec)
+    
+    def dominant_speaker(self, start_sec, end_sec):
+        """Спикер, говоривший больше всего в интервале (None, если была только тишина)"""
+        with self._lock:
+            labels = np.array(self.frame_labels[int(start_sec / self.hop_sec):int(end_sec / self.hop_sec) + 1])
+        labels = labels[labels >= 0]
+        if len(labels) == 0:
+            return None
+        return f"Speaker_{np.bincount(labels).argmax()}"
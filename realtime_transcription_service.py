@@ -1,55 +1,71 @@
 import json
-import queue
 import threading
-from vosk import KaldiRecognizer
-import pyaudio
+import time
 from model_manager import ModelManager
+from capture_service import AudioCaptureEngine
+
+
+# Политики при отставании распознавания от захвата
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # Пропустить накопленное аудио
+OVERFLOW_COALESCE = "coalesce"  # Подавать накопленное одним большим блоком без промежуточных результатов
+OVERFLOW_DEGRADE = "degrade"  # Перейти в быстрый режим (без слов и промежуточных результатов)
 
 
 class RealtimeTranscriber:
     """Сервис распознавания речи в реальном времени"""
     
-    def __init__(self, sample_rate=16000):
-        """Инициализация транскрибера"""
-        # Используем общую модель через менеджер
-        model_manager = ModelManager()
-        self.model = model_manager.get_model()
+    def __init__(self, sample_rate=16000, capture=None, block_size=4096,
+                 overflow_policy=OVERFLOW_COALESCE, max_lag_sec=2.0, partial_interval_sec=0.2,
+                 model_path=None):
+        """Инициализация транскрибера
+        
+        capture - общий AudioCaptureEngine,
+        overflow_policy - что делать, если отставание превысило max_lag_sec.
+        Объем очереди ограничен кольцевым буфером захвата.
+        partial_interval_sec - не чаще какого интервала разбирать промежуточный результат.
+        model_path - модель из ModelManager (None - модель по умолчанию).
+        """
+        # Используем общую модель через менеджер, распознаватель берется из пула на время записи.
+        # Ссылка на модель не хранится, чтобы менеджер мог выгрузить ее между записями
+        self.model_manager = ModelManager()
+        self.model_path = model_path
         self.sample_rate = sample_rate
-        self.recognizer = KaldiRecognizer(self.model, sample_rate)
-        self.recognizer.SetWords(True)
+        self.recognizer = None
         
-        self.audio = pyaudio.PyAudio()
-        self.stream = None
+        # Захват микрофона может быть общим с другими потребителями
+        self._owns_capture = capture is None
+        self.capture = capture or AudioCaptureEngine(sample_rate)
+        self.block_size = block_size
+        self.overflow_policy = overflow_policy
+        self.max_lag_sec = max_lag_sec
+        self.partial_interval_sec = partial_interval_sec
+        self._last_partial = ""
+        self._last_partial_time = 0.0
+        self.subscription = None
+        self.degraded = False
+        self._reset_metrics()
         self.is_transcribing = False
         self.transcription_thread = None
         
         # Callback для получения результатов
         self.on_partial_result_callback = None
         self.on_final_result_callback = None
-        
-        # Очередь для аудио данных
-        self.audio_queue = queue.Queue()
     
     def start_transcription(self):
-        """Начать распознавание"""
+        """Начать распознавание (модель лучше заранее загрузить в фоне: is_model_ready/wait_until_ready)"""
         if self.is_transcribing:
             return False
         
         self.is_transcribing = True
-        self.recognizer = KaldiRecognizer(self.model, self.sample_rate)
-        self.recognizer.SetWords(True)
-        
-        # Открываем поток аудио
-        self.stream = self.audio.open(
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=self.sample_rate,
-            input=True,
-            frames_per_buffer=4096,
-            stream_callback=self._audio_callback
-        )
+        self.recognizer = self.model_manager.acquire_recognizer(self.sample_rate, self.model_path)
+        self.degraded = False
+        self._last_partial = ""
+        self._last_partial_time = 0.0
+        self._reset_metrics()
         
-        self.stream.start_stream()
+        # Подключаемся к общему захвату
+        self.subscription = self.capture.subscribe(self.block_size)
+        self.capture.start()
         
         # Запускаем обработку в отдельном потоке
         self.transcription_thread = threading.Thread(target=self._process_audio)
@@ -57,35 +73,108 @@ class RealtimeTranscriber:
         
         return True
     
-    def _audio_callback(self, in_data, frame_count, time_info, status):
-        """Callback для получения аудио данных"""
-        self.audio_queue.put(in_data)
-        return (in_data, pyaudio.paContinue)
+    def is_model_ready(self):
+        """Загружена ли модель распознавания (иначе старт записи загрузит ее синхронно)"""
+        return self.model_manager.is_loaded(self.model_path)
+    
+    def wait_until_ready(self):
+        """Дождаться загрузки модели (вызывать не из потока интерфейса)"""
+        self.model_manager.wait_until_ready(self.model_path)
+    
+    def _reset_metrics(self):
+        """Сброс метрик очереди"""
+        self.metrics = {
+            "queue_depth": 0,  # Блоков ожидает распознавания
+            "lag_sec": 0.0,  # Текущее отставание от захвата
+            "max_lag_sec": 0.0,
+            "dropped_sec": 0.0,  # Пропущено аудио (политика drop_oldest или переполнение буфера)
+            "overflow_events": 0,
+            "processing_factor": 0.0,  # Время распознавания / длительность аудио (> 1 - не успеваем)
+        }
+        self._audio_sec = 0.0
+        self._processing_sec = 0.0
+    
+    def _read_block(self):
+        """Очередной блок с учетом политики переполнения; возвращает (data, нужны ли промежуточные)"""
+        lag_sec = self.subscription.lag_samples / self.sample_rate
+        overflow = lag_sec > self.max_lag_sec
+        if overflow:
+            self.metrics["overflow_events"] += 1
+        
+        if overflow and self.overflow_policy == OVERFLOW_DROP_OLDEST:
+            self.subscription.skip_to_latest(self.block_size)
+            data = self.subscription.read(timeout=0.1)
+        elif overflow or self.degraded:
+            # Накопленное подается одним вызовом, без разбора промежуточных результатов
+            if self.overflow_policy == OVERFLOW_DEGRADE:
+                self._set_degraded(lag_sec > self.max_lag_sec / 4)
+            data = self.subscription.read_available(int(self.max_lag_sec * self.sample_rate), timeout=0.1)
+        else:
+            data = self.subscription.read(timeout=0.1)
+        
+        self._update_metrics()
+        return data, not (overflow or self.degraded)
+    
+    def _set_degraded(self, degraded):
+        """Переключение быстрого режима распознавания"""
+        if degraded == self.degraded:
+            return
+        self.degraded = degraded
+        # Без пословных меток распознаватель работает заметно быстрее
+        self.recognizer.SetWords(not degraded)
+        print("⚠️ Распознавание не успевает, быстрый режим" if degraded else "✅ Распознавание догнало захват")
+    
+    def _update_metrics(self):
+        """Обновление метрик очереди"""
+        lag_samples = self.subscription.lag_samples
+        self.metrics["queue_depth"] = lag_samples // self.block_size
+        self.metrics["lag_sec"] = lag_samples / self.sample_rate
+        self.metrics["max_lag_sec"] = max(self.metrics["max_lag_sec"], self.metrics["lag_sec"])
+        self.metrics["dropped_sec"] = self.subscription.dropped_samples / self.sample_rate
+        if self._audio_sec:
+            self.metrics["processing_factor"] = self._processing_sec / self._audio_sec
+    
+    def get_metrics(self):
+        """Метрики очереди и отставания (копия)"""
+        return dict(self.metrics, degraded=self.degraded)
     
     def _process_audio(self):
         """Обработка аудио и распознавание (выполняется в отдельном потоке)"""
         while self.is_transcribing:
             try:
-                # Получаем данные из очереди с таймаутом
-                data = self.audio_queue.get(timeout=0.1)
+                # Получаем данные из общего буфера захвата с таймаутом
+                data, want_partial = self._read_block()
+                if data is None:
+                    continue
+                
+                started = time.perf_counter()
+                accepted = self.recognizer.AcceptWaveform(data)
+                self._processing_sec += time.perf_counter() - started
+                self._audio_sec += len(data) / 2 / self.sample_rate
                 
-                if self.recognizer.AcceptWaveform(data):
+                if accepted:
                     # Финальный результат (конец фразы)
                     result = json.loads(self.recognizer.Result())
+                    self._last_partial = ""
                     if result.get('text') and self.on_final_result_callback:
                         self.on_final_result_callback(result['text'])
-                else:
-                    # Промежуточный результат
-                    partial = json.loads(self.recognizer.PartialResult())
-                    if partial.get('partial') and self.on_partial_result_callback:
-                        self.on_partial_result_callback(partial['partial'])
-                        
-            except queue.Empty:
-                continue
+                elif want_partial and time.perf_counter() - self._last_partial_time >= self.partial_interval_sec:
+                    self._emit_partial()
+            
             except Exception as e:
                 print(f"Ошибка распознавания: {e}")
                 break
     
+    def _emit_partial(self):
+        """Разобрать промежуточный результат и передать его, только если текст изменился"""
+        self._last_partial_time = time.perf_counter()
+        text = json.loads(self.recognizer.PartialResult()).get('partial', '')
+        if not text or text == self._last_partial:
+            return
+        self._last_partial = text
+        if self.on_partial_result_callback:
+            self.on_partial_result_callback(text)
+    
     def stop_transcription(self):
         """Остановить распознавание"""
         if not self.is_transcribing:
@@ -93,21 +182,32 @@ class RealtimeTranscriber:
         
         self.is_transcribing = False
         
+        # Ждем завершения потока обработки
+        thread_alive = False
+        if self.transcription_thread:
+            self.transcription_thread.join(timeout=2)
+            thread_alive = self.transcription_thread.is_alive()
+        
         # Получаем финальный результат
         final_result = None
-        if self.recognizer:
+        if self.recognizer and thread_alive:
+            # Поток еще внутри AcceptWaveform (большой блок при перегрузке): распознаватель
+            # нельзя трогать и возвращать в пул, где его мог бы получить и сбросить другой поток
+            print("⚠️ Поток распознавания не завершился, распознаватель не возвращается в пул")
+            self.model_manager.discard_recognizer(self.recognizer)
+            self.recognizer = None
+        elif self.recognizer:
             result = json.loads(self.recognizer.FinalResult())
             if result.get('text'):
                 final_result = result['text']
+            self.model_manager.release_recognizer(self.recognizer)
+            self.recognizer = None
         
-        # Останавливаем поток
-        if self.stream:
-            self.stream.stop_stream()
-            self.stream.close()
-        
-        # Ждем завершения потока обработки
-        if self.transcription_thread:
-            self.transcription_thread.join(timeout=2)
+        # Отключаемся от захвата
+        if self.subscription:
+            self.subscription.close()
+            self.subscription = None
+            self.capture.stop()
         
         return final_result
     
@@ -122,5 +222,6 @@ class RealtimeTranscriber:
     def cleanup(self):
         """Очистка ресурсов"""
         self.stop_transcription()
-        self.audio.terminate()
+        if self._owns_capture:
+            self.capture.terminate()
 
@@ -1,36 +1,62 @@
 import pyaudio
-import wave
 import threading
 import time
+from collections import deque
 from datetime import datetime
 import os
+from vad_service import VoiceActivityDetector
+from wav_writer_service import StreamingWavWriter
+from capture_service import AudioCaptureEngine
 
 
 class AudioRecorder:
     """Сервис записи аудио в реальном времени"""
     
-    def __init__(self, sample_rate=16000, channels=1, chunk_size=1024):
-        """Инициализация рекордера"""
+    def __init__(self, sample_rate=16000, channels=1, chunk_size=1024, capture=None,
+                 max_segment_sec=30.0, pre_roll_sec=0.3):
+        """Инициализация рекордера (capture - общий AudioCaptureEngine)
+        
+        max_segment_sec - сегмент без пауз длиннее этого режется принудительно,
+        pre_roll_sec - сколько тишины перед речью остается в начале сегмента.
+        """
         self.sample_rate = sample_rate
         self.channels = channels
         self.chunk_size = chunk_size
         self.format = pyaudio.paInt16
         
-        self.audio = pyaudio.PyAudio()
-        self.stream = None
-        self.frames = []
+        # Захват микрофона может быть общим с другими потребителями
+        self._owns_capture = capture is None
+        self.capture = capture or AudioCaptureEngine(sample_rate, channels, chunk_size)
+        self.audio = self.capture.audio
+        self.subscription = None
+        self.writer = None
+        self.frame_count = 0  # Записано фреймов (отсчетов на канал)
         self.is_recording = False
         self.recording_thread = None
         self.output_file = None
         
         # Параметры для определения пауз
-        self.silence_threshold = 500  # Порог тишины
+        self.silence_threshold = 500  # Порог тишины (RMS отсчетов int16)
         self.silence_duration = 1.5  # Длительность паузы в секундах
         self.last_sound_time = time.time()
         self.pause_detected = False
+        self.silence_time = 0.0  # Длительность текущей тишины (по времени записи)
+        
+        # Детектор речи; его решения по фреймам доступны другим компонентам
+        self.vad = VoiceActivityDetector(sample_rate=sample_rate, start_threshold=self.silence_threshold,
+                                         stop_threshold=self.silence_threshold * 0.7)
         
         # Callback для обработки пауз
         self.on_pause_callback = None
+        
+        # Callback для каждого куска PCM (например, онлайн-диаризация)
+        self.on_chunk_callback = None
+        
+        # Сегменты между паузами: PCM копится, пока кто-то подписан на закрытые сегменты
+        self.max_segment_sec = max_segment_sec
+        self.pre_roll_sec = pre_roll_sec
+        self.on_segment_callback = None
+        self._reset_segment(0)
     
     def start_recording(self, output_dir="recordings"):
         """Начать запись"""
@@ -44,18 +70,24 @@ class AudioRecorder:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         self.output_file = os.path.join(output_dir, f"recording_{timestamp}.wav")
         
-        self.frames = []
+        # Запись идет сразу на диск, в памяти держится только очередь писателя
+        self.writer = StreamingWavWriter(
+            self.output_file,
+            sample_rate=self.sample_rate,
+            channels=self.channels,
+            sample_width=self.audio.get_sample_size(self.format)
+        )
+        self.frame_count = 0
         self.is_recording = True
         self.last_sound_time = time.time()
+        self.silence_time = 0.0
+        self.pause_detected = False
+        self.vad.reset()
+        self._reset_segment(0)
         
-        # Открываем поток
-        self.stream = self.audio.open(
-            format=self.format,
-            channels=self.channels,
-            rate=self.sample_rate,
-            input=True,
-            frames_per_buffer=self.chunk_size
-        )
+        # Подключаемся к общему захвату
+        self.subscription = self.capture.subscribe(self.chunk_size * self.channels)
+        self.capture.start()
         
         # Запускаем запись в отдельном потоке
         self.recording_thread = threading.Thread(target=self._record)
@@ -67,23 +99,34 @@ class AudioRecorder:
         """Процесс записи (выполняется в отдельном потоке)"""
         while self.is_recording:
             try:
-                data = self.stream.read(self.chunk_size, exception_on_overflow=False)
-                self.frames.append(data)
+                data = self.subscription.read(timeout=0.5)
+                if data is None:
+                    continue
+                self.writer.write(data)
+                n_frames = len(data) // (2 * self.channels)
+                self.frame_count += n_frames
+                
+                if self.on_chunk_callback:
+                    self.on_chunk_callback(data)
                 
-                # Проверяем уровень звука для определения пауз
-                audio_data = list(data)
-                if audio_data:
-                    avg_volume = sum(abs(b) for b in audio_data) / len(audio_data)
-                    
-                    if avg_volume > self.silence_threshold:
-                        self.last_sound_time = time.time()
-                        self.pause_detected = False
-                    else:
-                        # Проверяем, прошло ли достаточно времени для паузы
-                        if time.time() - self.last_sound_time > self.silence_duration:
-                            if not self.pause_detected and self.on_pause_callback:
-                                self.pause_detected = True
-                                self.on_pause_callback()
+                # Определение пауз по решениям детектора речи
+                is_speech = self.vad.process(data)
+                if self.on_segment_callback:
+                    self._append_segment(data, n_frames, is_speech)
+                
+                if is_speech:
+                    self.last_sound_time = time.time()
+                    self.silence_time = 0.0
+                    self.pause_detected = False
+                else:
+                    # Проверяем, прошло ли достаточно времени для паузы
+                    self.silence_time += n_frames / self.sample_rate
+                    if self.silence_time > self.silence_duration and not self.pause_detected:
+                        self.pause_detected = True
+                        # Сегмент закрывается до уведомления о паузе: границы у них совпадают
+                        self._close_segment()
+                        if self.on_pause_callback:
+                            self.on_pause_callback()
             except Exception as e:
                 print(f"Ошибка записи: {e}")
                 break
@@ -99,35 +142,78 @@ class AudioRecorder:
         if self.recording_thread:
             self.recording_thread.join()
         
-        # Закрываем поток
-        if self.stream:
-            self.stream.stop_stream()
-            self.stream.close()
-        
-        # Сохраняем в файл
-        if self.frames and self.output_file:
-            with wave.open(self.output_file, 'wb') as wf:
-                wf.setnchannels(self.channels)
-                wf.setsampwidth(self.audio.get_sample_size(self.format))
-                wf.setframerate(self.sample_rate)
-                wf.writeframes(b''.join(self.frames))
-            
+        # Отключаемся от захвата
+        if self.subscription:
+            self.subscription.close()
+            self.subscription = None
+            self.capture.stop()
+        
+        # Последний сегмент закрывается вместе с записью
+        self._close_segment()
+        
+        # Дописываем очередь и закрываем файл (заголовок обновляется при закрытии)
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        
+        if self.frame_count and self.output_file:
             return self.output_file
         
+        if self.output_file and os.path.exists(self.output_file):
+            os.remove(self.output_file)
         return None
     
+    def _reset_segment(self, start_frame):
+        """Начать новый сегмент с позиции start_frame"""
+        self._segment_chunks = deque()
+        self._segment_start = start_frame
+        self._segment_frames = 0
+        self._segment_has_speech = False
+    
+    def _append_segment(self, data, n_frames, is_speech):
+        """Добавить кусок PCM к текущему сегменту"""
+        self._segment_chunks.append((data, n_frames))
+        self._segment_frames += n_frames
+        self._segment_has_speech = self._segment_has_speech or is_speech
+        
+        if not self._segment_has_speech:
+            # До начала речи храним только короткий запас тишины
+            pre_roll = self.pre_roll_sec * self.sample_rate
+            while len(self._segment_chunks) > 1 and self._segment_frames - self._segment_chunks[0][1] >= pre_roll:
+                _, dropped = self._segment_chunks.popleft()
+                self._segment_frames -= dropped
+                self._segment_start += dropped
+        elif self._segment_frames > self.max_segment_sec * self.sample_rate:
+            self._close_segment()
+    
+    def _close_segment(self):
+        """Передать накопленный сегмент подписчику и начать следующий"""
+        if self._segment_has_speech and self.on_segment_callback:
+            pcm = b"".join(data for data, _ in self._segment_chunks)
+            start_sec = self._segment_start / self.sample_rate
+            end_sec = (self._segment_start + self._segment_frames) / self.sample_rate
+            self.on_segment_callback(pcm, start_sec, end_sec)
+        self._reset_segment(self.frame_count)
+    
     def get_recording_duration(self):
         """Получить текущую длительность записи в секундах"""
-        if not self.frames:
-            return 0
-        return len(self.frames) * self.chunk_size / self.sample_rate
+        return self.frame_count / self.sample_rate
     
     def set_pause_callback(self, callback):
         """Установить callback для обработки пауз"""
         self.on_pause_callback = callback
     
+    def set_chunk_callback(self, callback):
+        """Установить callback для каждого записанного куска PCM"""
+        self.on_chunk_callback = callback
+    
+    def set_segment_callback(self, callback):
+        """Установить callback для закрытых сегментов: callback(pcm, start_sec, end_sec)"""
+        self.on_segment_callback = callback
+    
     def cleanup(self):
         """Очистка ресурсов"""
         self.stop_recording()
-        self.audio.terminate()
+        if self._owns_capture:
+            self.capture.terminate()
 
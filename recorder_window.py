@@ -2,16 +2,29 @@ import customtkinter as ctk
 from tkinter import messagebox
 import threading
 import time
+import math
+import os
 from datetime import datetime, timedelta
 from recorder_service import AudioRecorder
 from realtime_transcription_service import RealtimeTranscriber
+from realtime_diarization_service import OnlineDiarizer
+from segment_transcription_service import SegmentTranscriber
+from capture_service import AudioCaptureEngine
+from model_manager import SMALL_MODEL_PATH
+from ui_update_service import UiUpdateThrottler
 
 
 class RecorderWindow:
     """Окно диктофона с распознаванием в реальном времени"""
     
-    def __init__(self, parent, on_recording_saved=None):
-        """Инициализация окна диктофона"""
+    def __init__(self, parent, on_recording_saved=None, ui_fps=10, two_pass=True):
+        """Инициализация окна диктофона
+        
+        ui_fps - частота обновления текста в окне,
+        two_pass - живой текст дает малая модель (если установлена).
+        Закрытые сегменты в любом случае распознаются большой моделью в фоне,
+        и к остановке записи транскрибация для анализа почти готова.
+        """
         self.parent = parent
         self.on_recording_saved = on_recording_saved
         
@@ -19,24 +32,49 @@ class RecorderWindow:
         self.window.title("ОТКЛИК - Диктофон")
         self.window.geometry("800x600")
         
-        # Сервисы
-        self.recorder = AudioRecorder()
-        self.transcriber = RealtimeTranscriber()  # Модель уже загружена через ModelManager
+        # Сервисы: один захват микрофона на запись, распознавание и индикатор уровня
+        self.capture = AudioCaptureEngine()
+        self.recorder = AudioRecorder(capture=self.capture)
+        self.two_pass = two_pass and os.path.exists(SMALL_MODEL_PATH)
+        live_model = SMALL_MODEL_PATH if self.two_pass else None
+        self.transcriber = RealtimeTranscriber(capture=self.capture, model_path=live_model)
+        self.segment_transcriber = SegmentTranscriber()
+        self.diarizer = OnlineDiarizer()
         
         # Состояние
         self.is_recording = False
+        self.model_loading = False  # Модель, выгруженная после простоя, загружается перед записью
         self.start_time = None
         self.saved_file = None
         self.current_segment = ""
+        self.segment_start_sec = 0.0  # Начало текущего сегмента во времени записи
         self.segments = []  # Список сегментов текста (реплик)
+        self.segment_bounds = []  # (начало, конец) сегментов во времени записи, по индексам segments
+        self.refined_pieces = []  # Уточненные куски записи (начало, конец, текст), еще не примененные
+        self.refined_count = 0  # Сколько сегментов уже обработано уточнением
+        self.refined_end_sec = -1.0  # Конец последнего уточненного куска
+        self.refining = False  # Идет ли уточнение сегментов после остановки записи
+        self.recorded_transcription = None  # Транскрибация сегментов для анализа без полного прохода
+        self.live_diarization = None
+        self.has_current_segment = False  # Показан ли незавершенный сегмент в конце текста
+        
+        # Обновления от потоков распознавания доставляются в окно пачками
+        self.ui_updates = UiUpdateThrottler(self.window, fps=ui_fps)
+        self.ui_updates.register("segments", self._add_segments_to_display, coalesce=False)
+        self.ui_updates.register("partial", self._update_current_segment_display)
+        self.ui_updates.register("refined", self._refine_segments, coalesce=False)
         
         # Настройка callbacks
         self.recorder.set_pause_callback(self._on_pause_detected)
+        self.recorder.set_chunk_callback(self.diarizer.feed)
         self.transcriber.set_partial_result_callback(self._on_partial_result)
         self.transcriber.set_final_result_callback(self._on_final_result)
+        self.recorder.set_segment_callback(self.segment_transcriber.submit)
+        self.segment_transcriber.set_segment_result_callback(self._on_segment_refined)
         
         self.create_widgets()
         self.update_timer()
+        self.ui_updates.start()
         
         # Обработка закрытия окна
         self.window.protocol("WM_DELETE_WINDOW", self._on_closing)
@@ -64,6 +102,12 @@ class RecorderWindow:
                                         text_color="#f0f0f0")
         self.timer_label.pack(pady=15)
         
+        # Индикатор уровня сигнала
+        self.level_bar = ctk.CTkProgressBar(control_frame, mode="determinate",
+                                            progress_color="#4cc9f0", width=300, height=8)
+        self.level_bar.set(0)
+        self.level_bar.pack(pady=(0, 10))
+        
         # Кнопки
         button_frame = ctk.CTkFrame(control_frame, fg_color="transparent")
         button_frame.pack(pady=10)
@@ -112,22 +156,31 @@ class RecorderWindow:
                     font=("Segoe UI", 14, "bold"), 
                     text_color="#f0f0f0").pack(anchor="w", padx=20, pady=(15, 5))
         
-        # Скроллируемый фрейм для сегментов
-        self.text_container = ctk.CTkScrollableFrame(
+        # Весь текст в одном виджете: Text отрисовывает только видимые строки,
+        # поэтому стоимость перерисовки не растет с длиной записи
+        self.transcript_box = ctk.CTkTextbox(
             transcription_frame,
             fg_color="#0d1b2a",
-            corner_radius=15
+            corner_radius=15,
+            font=("Segoe UI", 12),
+            text_color="#f0f0f0",
+            wrap="word",
+            state="disabled"
         )
-        self.text_container.pack(fill="both", expand=True, padx=20, pady=(5, 15))
+        self.transcript_box.pack(fill="both", expand=True, padx=20, pady=(5, 15))
+        
+        self.transcript_box.tag_config("hint", foreground="#808080", justify="center", spacing1=50)
+        self.transcript_box.tag_config("time", foreground="#9d4edd", spacing1=8)
+        self.transcript_box.tag_config("segment", foreground="#f0f0f0", lmargin1=10, lmargin2=10, spacing3=8)
+        self.transcript_box.tag_config("draft", foreground="#b0b0b0")  # Еще не уточнен большой моделью
+        self.transcript_box.tag_config("current_time", foreground="#4cc9f0", spacing1=8)
+        self.transcript_box.tag_config("current", foreground="#f0f0f0", background="#0a3d62",
+                                       lmargin1=10, lmargin2=10)
         
         # Начальное сообщение
-        self.empty_label = ctk.CTkLabel(
-            self.text_container,
-            text="Нажмите '⏺ Начать запись' для старта распознавания...",
-            font=("Segoe UI", 12),
-            text_color="#808080"
-        )
-        self.empty_label.pack(pady=50)
+        self._edit_transcript(lambda box: box.insert(
+            "end", "Нажмите '⏺ Начать запись' для старта распознавания...", "hint"
+        ))
     
     def toggle_recording(self):
         """Переключение записи"""
@@ -137,13 +190,28 @@ class RecorderWindow:
             self.stop_recording()
     
     def start_recording(self):
-        """Начать запись"""
+        """Начать запись (выгруженная после простоя модель сначала загружается в фоне)"""
+        if self.model_loading:
+            return
+        if not self.transcriber.is_model_ready():
+            self._load_model_then_record()
+            return
+        
         # Очищаем предыдущие сегменты
-        for widget in self.text_container.winfo_children():
-            widget.destroy()
+        self._edit_transcript(lambda box: box.delete("1.0", "end"))
+        self.has_current_segment = False
         
         self.segments = []
+        self.segment_bounds = []
+        self.refined_pieces = []
+        self.refined_count = 0
+        self.refined_end_sec = -1.0
         self.current_segment = ""
+        self.segment_start_sec = 0.0
+        self.live_diarization = None
+        self.recorded_transcription = None
+        self.diarizer.reset()
+        self.segment_transcriber.start()
         
         # Запускаем запись и транскрипцию
         if self.recorder.start_recording() and self.transcriber.start_transcription():
@@ -158,6 +226,33 @@ class RecorderWindow:
             self.status_indicator.configure(text="🔴 Идет запись...", text_color="#e63946")
             self.analyze_button.configure(state="disabled")
     
+    def _load_model_then_record(self):
+        """Загрузить модель в фоновом потоке и начать запись, когда она готова"""
+        self.model_loading = True
+        self.record_button.configure(state="disabled")
+        self.status_indicator.configure(text="⏳ Загрузка модели распознавания...", text_color="#f0f0f0")
+        
+        def wait():
+            """Ожидание загрузки (не в потоке интерфейса)"""
+            try:
+                self.transcriber.wait_until_ready()
+            except Exception as e:
+                self.window.after(0, lambda error=e: self._on_model_loaded(error))
+                return
+            self.window.after(0, self._on_model_loaded)
+        
+        threading.Thread(target=wait, daemon=True).start()
+    
+    def _on_model_loaded(self, error=None):
+        """Модель загружена (или загрузка не удалась)"""
+        self.model_loading = False
+        self.record_button.configure(state="normal")
+        if error is not None:
+            self.status_indicator.configure(text="❌ Модель не загружена", text_color="#e63946")
+            messagebox.showerror("Ошибка", f"Не удалось загрузить модель распознавания: {error}")
+            return
+        self.start_recording()
+    
     def stop_recording(self):
         """Остановить запись"""
         if not self.is_recording:
@@ -166,8 +261,18 @@ class RecorderWindow:
         self.is_recording = False
         
         # Останавливаем транскрипцию и запись
-        self.transcriber.stop_transcription()
+        final_text = self.transcriber.stop_transcription()
+        if final_text:
+            self.current_segment = final_text
         self.saved_file = self.recorder.stop_recording()
+        # Последний сегмент закрыт остановкой записи, как паузой
+        self._on_pause_detected()
+        self.live_diarization = self.diarizer.get_timeline()
+        self.ui_updates.flush()
+        
+        # Оставшиеся сегменты дораспознаются в фоне, анализ доступен после этого
+        self.segment_transcriber.stop(wait=False)
+        self.refining = True
         
         self.record_button.configure(
             text="⏺ Начать запись",
@@ -175,14 +280,11 @@ class RecorderWindow:
             hover_color="#d62828"
         )
         self.status_indicator.configure(text="✅ Запись завершена и сохранена", text_color="#4cc9f0")
-        
-        if self.saved_file:
-            self.analyze_button.configure(state="normal")
     
     def _on_partial_result(self, text):
         """Обработка промежуточных результатов"""
         self.current_segment = text
-        self._update_current_segment_display()
+        self.ui_updates.post("partial", text)
     
     def _on_final_result(self, text):
         """Обработка финального результата (конец фразы)"""
@@ -192,80 +294,108 @@ class RecorderWindow:
     
     def _on_pause_detected(self):
         """Обработка обнаружения паузы"""
+        segment_end_sec = self.recorder.get_recording_duration()
         if self.current_segment.strip():
             # Добавляем текущий сегмент в список
             timestamp = datetime.now().strftime("%H:%M:%S")
-            self.segments.append((timestamp, self.current_segment))
+            text = self.current_segment
+            speaker = self.diarizer.dominant_speaker(self.segment_start_sec, segment_end_sec)
+            index = len(self.segments)
+            self.segment_bounds.append((self.segment_start_sec, segment_end_sec))
+            self.segments.append((timestamp, text, speaker))
             
-            # Обновляем GUI в главном потоке
-            self.window.after(0, lambda: self._add_segment_to_display(timestamp, self.current_segment))
+            # Обновляем GUI в главном потоке (ближайшим кадром)
+            self.ui_updates.discard("partial")
+            self.ui_updates.post("segments", (index, timestamp, text, speaker))
             
             # Очищаем текущий сегмент
             self.current_segment = ""
+        self.segment_start_sec = segment_end_sec
     
-    def _add_segment_to_display(self, timestamp, text):
-        """Добавить сегмент в отображение"""
-        segment_frame = ctk.CTkFrame(self.text_container, fg_color="#1a1a2e", corner_radius=10)
-        segment_frame.pack(fill="x", pady=5, padx=5)
-        
-        # Метка времени
-        time_label = ctk.CTkLabel(
-            segment_frame,
-            text=f"[{timestamp}]",
-            font=("Segoe UI", 10, "bold"),
-            text_color="#9d4edd"
-        )
-        time_label.pack(anchor="w", padx=10, pady=(5, 0))
+    def _edit_transcript(self, edit):
+        """Изменить текст расшифровки (с автопрокруткой, если пользователь внизу)"""
+        box = self.transcript_box
+        at_bottom = box.yview()[1] >= 0.999
+        box.configure(state="normal")
+        edit(box)
+        box.configure(state="disabled")
+        if at_bottom:
+            box.see("end")
+    
+    def _add_segments_to_display(self, segments):
+        """Добавить пачку сегментов в отображение"""
+        def edit(box):
+            # Незавершенный сегмент всегда последний, его заменяют готовые сегменты
+            if self.has_current_segment:
+                box.delete("current_start", "end")
+                self.has_current_segment = False
+            for index, timestamp, text, speaker in segments:
+                header = f"[{timestamp}] {speaker}" if speaker else f"[{timestamp}]"
+                box.insert("end", header + "\n", "time")
+                # Метка начала текста нужна, чтобы заменить его уточненным
+                box.mark_set(f"segment_{index}", "end-1c")
+                box.mark_gravity(f"segment_{index}", "left")
+                box.insert("end", text + "\n", ("segment", "draft") if self.two_pass else "segment")
         
-        # Текст сегмента
-        text_label = ctk.CTkLabel(
-            segment_frame,
-            text=text,
-            font=("Segoe UI", 12),
-            text_color="#f0f0f0",
-            wraplength=700,
-            justify="left"
-        )
-        text_label.pack(anchor="w", padx=10, pady=(2, 10))
+        self._edit_transcript(edit)
+    
+    def _on_segment_refined(self, start_sec, end_sec, text):
+        """Кусок записи распознан большой моделью (вызывается из фонового потока, text=None - ошибка)"""
+        self.ui_updates.post("refined", (start_sec, end_sec, text))
+    
+    def _refine_segments(self, refined):
+        """Накопить уточненные куски и применить их к готовым сегментам"""
+        self.refined_pieces.extend(refined)
+        self.refined_end_sec = max([self.refined_end_sec] + [end_sec for _, end_sec, _ in refined])
+        self._apply_refined()
+    
+    def _apply_refined(self, final=False):
+        """Заменить черновой текст сегментов, все куски которых уже уточнены.
+        
+        Сегмент между паузами может состоять из нескольких кусков, если рекордер
+        разрезал длинную реплику по max_segment_sec. Куски распознаются по порядку,
+        поэтому сегмент готов, когда пришел кусок, кончающийся не раньше него
+        (final - распознано все, применяются оставшиеся сегменты).
+        """
+        eps = 1e-3
+        
+        def edit(box):
+            while self.refined_count < len(self.segment_bounds):
+                index = self.refined_count
+                start_sec, end_sec = self.segment_bounds[index]
+                if not final and self.refined_end_sec < end_sec - eps:
+                    break
+                
+                # Куски до начала сегмента относятся к паузам без текста и отбрасываются
+                pieces = sorted(piece for piece in self.refined_pieces if piece[1] <= end_sec + eps)
+                self.refined_pieces = [piece for piece in self.refined_pieces if piece[1] > end_sec + eps]
+                self.refined_count += 1
+                texts = [text for _, piece_end, text in pieces if piece_end > start_sec + eps]
+                # При ошибке распознавания любого куска остается черновой текст
+                if None in texts or not any(texts):
+                    continue
+                
+                text = " ".join(text for text in texts if text)
+                timestamp, _, speaker = self.segments[index]
+                self.segments[index] = (timestamp, text, speaker)
+                box.delete(f"segment_{index}", f"segment_{index} lineend")
+                box.insert(f"segment_{index}", text, "segment")
         
-        # Разделитель
-        separator = ctk.CTkFrame(self.text_container, fg_color="#4cc9f0", height=2)
-        separator.pack(fill="x", pady=3)
+        self._edit_transcript(edit)
     
-    def _update_current_segment_display(self):
+    def _update_current_segment_display(self, text):
         """Обновить отображение текущего сегмента"""
-        # Проверяем, есть ли уже фрейм для текущего сегмента
-        children = self.text_container.winfo_children()
-        
-        if children and hasattr(children[-1], '_is_current'):
-            # Обновляем существующий
-            current_frame = children[-1]
-            for widget in current_frame.winfo_children():
-                if isinstance(widget, ctk.CTkLabel) and widget.cget("text") != "⏱️ Сейчас...":
-                    widget.configure(text=self.current_segment)
-        else:
-            # Создаем новый фрейм для текущего сегмента
-            current_frame = ctk.CTkFrame(self.text_container, fg_color="#0a3d62", corner_radius=10)
-            current_frame._is_current = True
-            current_frame.pack(fill="x", pady=5, padx=5)
-            
-            time_label = ctk.CTkLabel(
-                current_frame,
-                text="⏱️ Сейчас...",
-                font=("Segoe UI", 10, "bold"),
-                text_color="#4cc9f0"
-            )
-            time_label.pack(anchor="w", padx=10, pady=(5, 0))
-            
-            text_label = ctk.CTkLabel(
-                current_frame,
-                text=self.current_segment,
-                font=("Segoe UI", 12),
-                text_color="#f0f0f0",
-                wraplength=700,
-                justify="left"
-            )
-            text_label.pack(anchor="w", padx=10, pady=(2, 10))
+        def edit(box):
+            if self.has_current_segment:
+                box.delete("current_start", "end")
+            else:
+                box.mark_set("current_start", "end-1c")
+                box.mark_gravity("current_start", "left")
+                self.has_current_segment = True
+            box.insert("end", "⏱️ Сейчас...\n", "current_time")
+            box.insert("end", text, "current")
+        
+        self._edit_transcript(edit)
     
     def update_timer(self):
         """Обновление таймера"""
@@ -275,10 +405,48 @@ class RecorderWindow:
             minutes = int((elapsed % 3600) // 60)
             seconds = int(elapsed % 60)
             self.timer_label.configure(text=f"{hours:02d}:{minutes:02d}:{seconds:02d}")
+            
+            # Уровень в дБ от -60 до 0 переводим в 0..1
+            level_db = 20 * math.log10(max(self.capture.level, 1e-6))
+            self.level_bar.set(min(max((level_db + 60) / 60, 0), 1))
+            
+            # Предупреждение, если распознавание перестало успевать за записью
+            metrics = self.transcriber.get_metrics()
+            if metrics["lag_sec"] > self.transcriber.max_lag_sec or metrics["degraded"]:
+                self.status_indicator.configure(
+                    text=f"🔴 Идет запись... ⚠️ распознавание отстает на {metrics['lag_sec']:.1f} с",
+                    text_color="#e63946"
+                )
+            else:
+                self.status_indicator.configure(text="🔴 Идет запись...", text_color="#e63946")
+        else:
+            self.level_bar.set(0)
+            
+            # Прогресс уточнения сегментов после остановки
+            if self.refining:
+                pending = self.segment_transcriber.pending
+                if pending:
+                    self.status_indicator.configure(
+                        text=f"⏳ Распознавание сегментов для анализа: осталось {pending}", text_color="#4cc9f0"
+                    )
+                else:
+                    self._on_refining_finished()
         
         # Планируем следующее обновление
         self.window.after(100, self.update_timer)
     
+    def _on_refining_finished(self):
+        """Все сегменты записи распознаны большой моделью"""
+        self.refining = False
+        self.ui_updates.flush()
+        self._apply_refined(final=True)
+        # Неполная транскрибация (часть сегментов с ошибкой) не используется - нужен полный анализ
+        if not self.segment_transcriber.failed:
+            self.recorded_transcription = self.segment_transcriber.get_transcription()
+        self.status_indicator.configure(text="✅ Запись сохранена, текст уточнен", text_color="#4cc9f0")
+        if self.saved_file:
+            self.analyze_button.configure(state="normal")
+    
     def analyze_recording(self):
         """Запустить полный анализ записи"""
         if not self.saved_file:
@@ -287,7 +455,8 @@ class RecorderWindow:
         
         # Вызываем callback для передачи файла в главное окно
         if self.on_recording_saved:
-            self.on_recording_saved(self.saved_file)
+            self.on_recording_saved(self.saved_file, diarization=self.live_diarization,
+                                    transcription=self.recorded_transcription)
             self.window.destroy()
     
     def _on_closing(self):
@@ -304,8 +473,11 @@ class RecorderWindow:
     def _cleanup(self):
         """Очистка ресурсов"""
         try:
+            self.ui_updates.stop()
+            self.segment_transcriber.stop(wait=False)
             self.transcriber.cleanup()
             self.recorder.cleanup()
+            self.capture.terminate()
         except:
             pass
 
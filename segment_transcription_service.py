@@ -0,0 +1,107 @@
+import queue
+import threading
+from model_manager import ModelManager
+from transcribation_service import transcribe_pcm
+
+
+class SegmentTranscriber:
+    """Фоновое повторное распознавание закрытых сегментов записи точной (большой) моделью.
+    
+    Сегменты распознаются по мере поступления, поэтому к концу записи
+    точная расшифровка почти готова. Результаты в формате transcribe_audio,
+    метки слов - во времени всей записи.
+    """
+    
+    def __init__(self, sample_rate=16000, model_path=None):
+        """Инициализация (model_path - модель из ModelManager, None - модель по умолчанию)"""
+        self.sample_rate = sample_rate
+        self.model_path = model_path
+        self.model_manager = ModelManager()
+        self.on_segment_result_callback = None
+        
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._segments = []  # (start_sec, end_sec, результаты распознавания)
+        self._pending = 0
+        self._failed = 0
+        self._thread = None
+    
+    def start(self):
+        """Запустить фоновый поток (результаты предыдущей записи сбрасываются)"""
+        self.stop(wait=False)
+        # Своя очередь и список на каждую запись: поток прошлой записи может еще дорабатывать
+        self._queue = queue.Queue()
+        with self._lock:
+            self._segments = []
+            self._pending = 0
+            self._failed = 0
+        self.model_manager.preload(self.model_path)
+        self._thread = threading.Thread(target=self._run, args=(self._queue, self._segments), daemon=True)
+        self._thread.start()
+    
+    def submit(self, pcm, start_sec, end_sec):
+        """Поставить сегмент PCM int16 (bytes) в очередь на распознавание"""
+        with self._lock:
+            self._pending += 1
+        self._queue.put((pcm, start_sec, end_sec))
+    
+    def _run(self, segment_queue, segments):
+        """Цикл распознавания сегментов (выполняется в отдельном потоке)"""
+        while True:
+            item = segment_queue.get()
+            if item is None:
+                break
+            pcm, start_sec, end_sec = item
+            try:
+                with self.model_manager.recognizer(self.sample_rate, self.model_path) as rec:
+                    results = transcribe_pcm(rec, pcm, start_sec)
+            except Exception as e:
+                print(f"Ошибка распознавания сегмента: {e}")
+                results = None
+            
+            with self._lock:
+                if results is not None:
+                    segments.append((start_sec, end_sec, results))
+            try:
+                if self.on_segment_result_callback:
+                    text = None if results is None else " ".join(
+                        result["text"] for result in results if result.get("text")
+                    )
+                    self.on_segment_result_callback(start_sec, end_sec, text)
+            finally:
+                # Сегмент считается готовым только после того, как callback передал результат:
+                # иначе pending == 0 мог бы наступить раньше, чем последний текст дошел до окна
+                with self._lock:
+                    # Счетчики относятся только к текущей записи
+                    if segment_queue is self._queue:
+                        self._pending -= 1
+                        self._failed += results is None
+    
+    @property
+    def pending(self):
+        """Сколько сегментов еще не распознано"""
+        return self._pending
+    
+    @property
+    def failed(self):
+        """Сколько сегментов не удалось распознать (транскрибация тогда неполная)"""
+        return self._failed
+    
+    def stop(self, wait=True):
+        """Дораспознать очередь и остановить поток (wait=False - не ждать завершения)"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        if wait:
+            self._thread.join()
+        self._thread = None
+    
+    def get_transcription(self):
+        """Распознанные сегменты в порядке времени (формат transcribe_audio)"""
+        with self._lock:
+            segments = sorted(self._segments, key=lambda segment: segment[0])
+        return [result for _, _, results in segments for result in results]
+    
+    def set_segment_result_callback(self, callback):
+        """Установить callback для распознанных сегментов: callback(start_sec, end_sec, text), text=None - ошибка"""
+        self.on_segment_result_callback = callback
@@ -0,0 +1,70 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pyaudio")
+
+from capture_service import PcmRingBuffer
+
+
+def pcm(start, stop):
+    """Отсчеты start..stop-1 в байтах PCM int16"""
+    return np.arange(start, stop, dtype=np.int16).tobytes()
+
+
+def samples(data):
+    return np.frombuffer(data, dtype=np.int16).tolist()
+
+
+def test_read_follows_write_positions():
+    """Читатель получает отсчеты по порядку и продолжает с новой позиции"""
+    buffer = PcmRingBuffer(10)
+    buffer.write(pcm(0, 6))
+    data, position, dropped = buffer.read(0, 1, 4, timeout=0)
+    assert samples(data) == [0, 1, 2, 3]
+    assert (position, dropped) == (4, 0)
+    
+    # Запись через границу кольца
+    buffer.write(pcm(6, 13))
+    data, position, dropped = buffer.read(position, 1, 100, timeout=0)
+    assert samples(data) == list(range(4, 13))
+    assert (position, dropped) == (13, 0)
+
+
+def test_not_enough_samples_returns_none():
+    """Пока данных меньше min_samples, чтение не продвигает позицию"""
+    buffer = PcmRingBuffer(10)
+    buffer.write(pcm(0, 3))
+    assert buffer.read(0, 5, 10, timeout=0) == (None, 0, 0)
+    
+    # После закрытия отдается остаток
+    buffer.close()
+    data, position, dropped = buffer.read(0, 5, 10, timeout=0)
+    assert samples(data) == [0, 1, 2]
+    assert (position, dropped) == (3, 0)
+
+
+def test_lagging_reader_counts_dropped_samples():
+    """Отставший больше емкости читатель получает последние отсчеты и число потерянных"""
+    buffer = PcmRingBuffer(10)
+    buffer.write(pcm(0, 8))
+    buffer.write(pcm(8, 16))
+    data, position, dropped = buffer.read(2, 1, 100, timeout=0)
+    assert samples(data) == list(range(6, 16))
+    assert (position, dropped) == (16, 4)
+
+
+def test_oversized_write_keeps_tail_at_true_position():
+    """Кусок больше емкости: хранится его хвост, отброшенное начало считается потерянным"""
+    buffer = PcmRingBuffer(10)
+    buffer.write(pcm(0, 3))
+    buffer.write(pcm(3, 28))
+    assert buffer.total_written == 28
+    data, position, dropped = buffer.read(0, 1, 100, timeout=0)
+    assert samples(data) == list(range(18, 28))
+    assert (position, dropped) == (28, 18)
+    
+    # Следующие записи продолжают поток без сдвига
+    buffer.write(pcm(28, 31))
+    data, position, dropped = buffer.read(position, 1, 100, timeout=0)
+    assert samples(data) == [28, 29, 30]
+    assert (position, dropped) == (31, 0)
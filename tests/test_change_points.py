@@ -0,0 +1,39 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("librosa")
+pytest.importorskip("sklearn")
+
+from dyarise_service import detect_change_points
+
+
+def make_turns(seed, turns, dim=13):
+    """Признаки чередующихся спикеров: turns - список (число кадров, сдвиг среднего)"""
+    rng = np.random.default_rng(seed)
+    return np.vstack([rng.normal(size=(n_frames, dim)) + shift for n_frames, shift in turns])
+
+
+def test_stationary_speaker_has_no_changes():
+    """На одном спикере смены не находятся"""
+    for seed in range(20):
+        assert len(detect_change_points(make_turns(seed, [(600, 0.0)]))) == 0
+
+
+@pytest.mark.parametrize("turn_frames", [60, 120])
+def test_changes_are_localized(turn_frames):
+    """Границы реплик находятся на своих местах, без лишних смен до и после них"""
+    expected = np.array([turn_frames, 2 * turn_frames])
+    hits = 0
+    for seed in range(20):
+        features = make_turns(seed, [(turn_frames, 0.0), (turn_frames, 2.0), (turn_frames, 0.0)])
+        change_points = detect_change_points(features)
+        hits += len(change_points) == len(expected) and np.all(np.abs(change_points - expected) <= 3)
+    assert hits >= 18
+
+
+def test_change_near_window_end_is_not_taken_early():
+    """Граница дальше начального окна не фиксируется на его краю"""
+    for seed in range(20):
+        change_points = detect_change_points(make_turns(seed, [(200, 0.0), (200, 1.5)]))
+        assert len(change_points) == 1
+        assert abs(change_points[0] - 200) <= 3
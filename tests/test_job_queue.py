@@ -0,0 +1,97 @@
+import threading
+import pytest
+
+pytest.importorskip("numpy")
+
+from job_queue_service import (
+    AnalysisJobQueue, JobCancelled, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_CANCELLED
+)
+
+TIMEOUT = 5
+
+
+class FakeAnalysisQueue(AnalysisJobQueue):
+    """Очередь без анализа: задача записывает свой запуск и ждет разрешения завершиться"""
+    
+    def __init__(self, workers=1):
+        super().__init__(workers=workers, state_path=None)
+        self.started = []
+        self.release = threading.Event()
+        self.release.set()
+        self.running = threading.Event()
+        self.events = []
+        self.finished = threading.Semaphore(0)
+        self.add_listener(self._record)
+    
+    def _record(self, job, event):
+        self.events.append((job.audio_path, event))
+        if event in (JOB_DONE, JOB_CANCELLED):
+            self.finished.release()
+    
+    def _run_job(self, job):
+        self.started.append(job.audio_path)
+        self.running.set()
+        try:
+            while not self.release.wait(0.01):
+                if job.cancel_requested:
+                    raise JobCancelled()
+            job.status = JOB_DONE
+        except JobCancelled:
+            job.status = JOB_CANCELLED
+    
+    def wait_finished(self, count):
+        for _ in range(count):
+            assert self.finished.acquire(timeout=TIMEOUT)
+
+
+@pytest.fixture
+def queue():
+    queue = FakeAnalysisQueue()
+    yield queue
+    queue.release.set()
+    queue.shutdown(wait=True)
+
+
+def test_queued_is_emitted_before_running(queue):
+    """Подписчик получает queued раньше, чем running и done"""
+    queue.start()
+    for i in range(20):
+        queue.submit(f"file_{i}.wav")
+    queue.wait_finished(20)
+    for i in range(20):
+        events = [event for path, event in queue.events if path == f"file_{i}.wav"]
+        assert events == [JOB_QUEUED, JOB_RUNNING, JOB_DONE]
+
+
+def test_higher_priority_runs_first(queue):
+    """Задачи запускаются по убыванию приоритета, при равном - в порядке постановки"""
+    for path, priority in [("a", 0), ("b", 1), ("c", 0), ("d", 2)]:
+        queue.submit(path, priority=priority)
+    queue.start()
+    queue.wait_finished(4)
+    assert queue.started == ["d", "b", "a", "c"]
+
+
+def test_cancel_queued_job_never_runs(queue):
+    """Ожидающая задача снимается сразу и не запускается"""
+    job = queue.submit("a")
+    queue.submit("b")
+    assert queue.cancel(job.id)
+    assert job.status == JOB_CANCELLED
+    queue.start()
+    queue.wait_finished(2)
+    assert queue.started == ["b"]
+    assert not queue.cancel(job.id)
+
+
+def test_cancel_running_job(queue):
+    """Выполняющаяся задача прерывается на ближайшей проверке"""
+    queue.release.clear()
+    queue.start()
+    job = queue.submit("a")
+    assert queue.running.wait(TIMEOUT)
+    assert job.status == JOB_RUNNING
+    assert queue.cancel(job.id)
+    queue.wait_finished(1)
+    assert job.status == JOB_CANCELLED
+    assert (job.audio_path, JOB_CANCELLED) in queue.events
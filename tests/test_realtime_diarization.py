@@ -0,0 +1,32 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("librosa")
+pytest.importorskip("sklearn")
+
+from realtime_diarization_service import OnlineDiarizer
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_single_speaker_stays_one_speaker(seed):
+    """Окна одного стационарного спикера не порождают новых спикеров"""
+    rng = np.random.default_rng(seed)
+    diarizer = OnlineDiarizer()
+    labels = [diarizer._assign(features) for features in rng.normal(10.0, 5.0, size=(200, 13))]
+
+    assert len(diarizer._centroids) == 1
+    assert set(labels) == {0}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_two_speakers_are_separated(seed):
+    """Вернувшийся первый спикер узнается, второй получает свою метку"""
+    rng = np.random.default_rng(seed)
+    frames = np.vstack([rng.normal(size=(60, 13)), rng.normal(size=(60, 13)) + 2.0, rng.normal(size=(60, 13))])
+    diarizer = OnlineDiarizer()
+    labels = np.array([diarizer._assign(features) for features in frames])
+
+    assert len(diarizer._centroids) == 2
+    assert np.all(labels[:60] == 0)
+    assert np.mean(labels[60:120] == 1) > 0.9
+    assert np.mean(labels[120:] == 0) > 0.9
@@ -0,0 +1,44 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("librosa")
+pytest.importorskip("sklearn")
+
+from dyarise_service import SpeakerTimeline, UNKNOWN_SPEAKER
+
+LABELS = ["Speaker_0", "Speaker_1"]
+
+
+def test_speakers_at_matches_speaker_at():
+    """Векторный поиск совпадает с поштучным, паузы и края дают спикера по умолчанию"""
+    timeline = SpeakerTimeline([0.0, 2.0, 5.0], [1.5, 4.0, 6.0], [0, 1, 0], LABELS)
+    times = [-1.0, 0.0, 1.0, 1.5, 1.7, 2.0, 3.9, 4.0, 5.5, 6.0, 10.0]
+    expected = [timeline.speaker_at(time) for time in times]
+    assert timeline.speakers_at(times).tolist() == expected
+    assert expected == [UNKNOWN_SPEAKER, "Speaker_0", "Speaker_0", UNKNOWN_SPEAKER, UNKNOWN_SPEAKER,
+                        "Speaker_1", "Speaker_1", UNKNOWN_SPEAKER, "Speaker_0", UNKNOWN_SPEAKER, UNKNOWN_SPEAKER]
+
+
+def test_speakers_at_empty_timeline():
+    """Пустая диаризация - все слова у спикера по умолчанию"""
+    timeline = SpeakerTimeline([], [], [], LABELS)
+    assert timeline.speakers_at([0.0, 1.0]).tolist() == [UNKNOWN_SPEAKER, UNKNOWN_SPEAKER]
+
+
+def test_from_frame_labels_compresses_runs_and_skips_silence():
+    """Кадры сжимаются в реплики, тишина (-1) остается паузой"""
+    timeline = SpeakerTimeline.from_frame_labels([0, 0, -1, -1, 1, 1, 1], 0.5, LABELS)
+    assert list(timeline) == [(0.0, 1.0, "Speaker_0"), (2.0, 3.5, "Speaker_1")]
+
+
+def test_from_frame_labels_absorbs_short_runs():
+    """Короткая вставка другого спикера присоединяется к соседу и склеивается с ним"""
+    frame_labels = [0] * 6 + [1] + [0] * 6 + [1] * 4
+    timeline = SpeakerTimeline.from_frame_labels(frame_labels, 0.5, LABELS, min_segment_sec=1.0)
+    assert list(timeline) == [(0.0, 6.5, "Speaker_0"), (6.5, 8.5, "Speaker_1")]
+
+
+def test_from_frame_labels_keeps_short_run_between_silences():
+    """Реплика без соседних спикеров не сглаживается"""
+    timeline = SpeakerTimeline.from_frame_labels([-1, -1, 1, -1, -1], 0.5, LABELS, min_segment_sec=1.0)
+    assert list(timeline) == [(1.0, 1.5, "Speaker_1")]
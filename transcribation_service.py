@@ -1,48 +1,181 @@
 import json
 import wave
 import io
+import os
+import multiprocessing
 import numpy as np
-from vosk import KaldiRecognizer
-import librosa
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from vosk import KaldiRecognizer, Model
 from model_manager import ModelManager
+from audio_service import SAMPLE_RATE, decode_audio, split_at_silence, stream_pcm_blocks
 
+# Пул процессов для параллельной транскрибации: (путь модели, число воркеров) -> executor
+_pool = None
+_pool_key = None
 
-def convert_to_wav(audio_path):
-    """Конвертирует аудиофайл в WAV формат"""
-    audio, sr = librosa.load(audio_path, sr=16000, mono=True)
-    audio_int16 = (audio * 32767).astype(np.int16)
+# Модель, загруженная в процессе-воркере
+_worker_model = None
+
+
+def convert_to_wav(audio, output=None):
+    """Конвертирует аудиофайл (путь или DecodedAudio) в WAV формат.
     
-    wav_data = io.BytesIO()
+    output - путь или файловый объект, по умолчанию WAV собирается в памяти.
+    Аудио декодируется и записывается блоками, без полной копии в int16.
+    """
+    wav_data = io.BytesIO() if output is None else output
     with wave.open(wav_data, 'wb') as wf:
         wf.setnchannels(1)
         wf.setsampwidth(2)
-        wf.setframerate(16000)
-        wf.writeframes(audio_int16.tobytes())
-    wav_data.seek(0)
+        wf.setframerate(SAMPLE_RATE)
+        for data in stream_pcm_blocks(audio):
+            wf.writeframes(data)
+    if output is None:
+        wav_data.seek(0)
     return wav_data
 
 
-def transcribe_audio(audio_path):
-    """Транскрибирует аудиофайл"""
-    # Используем общую модель через менеджер
-    model_manager = ModelManager()
-    model = model_manager.get_model()
+def _init_worker(model_path):
+    """Загрузка собственной модели в процессе-воркере"""
+    global _worker_model
+    _worker_model = Model(model_path)
+
+
+def _transcribe_chunk(pcm, sample_rate, offset_sec):
+    """Распознает кусок PCM в воркере и сдвигает метки слов на offset_sec.
     
-    wav_data = convert_to_wav(audio_path)
-    wf = wave.open(wav_data, "rb")
-    rec = KaldiRecognizer(model, wf.getframerate())
+    pcm - bytes или (путь к PCM из кэша, начало, конец): тогда воркер
+    читает кусок сам через mmap, и аудио не пересылается между процессами.
+    """
+    if isinstance(pcm, tuple):
+        path, start, end = pcm
+        pcm = np.memmap(path, dtype=np.int16, mode="r")[start:end].tobytes()
+    rec = KaldiRecognizer(_worker_model, sample_rate)
     rec.SetWords(True)
+    return transcribe_pcm(rec, pcm, offset_sec)
+
+
+def transcribe_pcm(rec, pcm, offset_sec=0.0, cancel_check=None):
+    """Распознает PCM int16 (bytes) готовым распознавателем и сдвигает метки слов на offset_sec.
     
+    cancel_check - вызывается перед каждым блоком и выбрасывает исключение при отмене.
+    """
     results = []
-    while True:
-        data = wf.readframes(4000)
-        if len(data) == 0:
-            break
-        if rec.AcceptWaveform(data):
+    block_bytes = 4000 * 2
+    for pos in range(0, len(pcm), block_bytes):
+        if cancel_check:
+            cancel_check()
+        if rec.AcceptWaveform(pcm[pos:pos + block_bytes]):
             results.append(json.loads(rec.Result()))
-    
     results.append(json.loads(rec.FinalResult()))
     
+    for result in results:
+        for word_info in result.get("result", []):
+            word_info["start"] += offset_sec
+            word_info["end"] += offset_sec
+    return results
+
+
+def _get_pool(model_path, workers):
+    """Пул процессов переиспользуется, чтобы не загружать модели заново"""
+    global _pool, _pool_key
+    key = (model_path, workers)
+    if _pool is None or _pool_key != key:
+        shutdown_transcription_pool()
+        # spawn: не наследуем загруженную модель и потоки GUI родителя
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_path,)
+        )
+        _pool_key = key
+    return _pool
+
+
+def shutdown_transcription_pool():
+    """Остановить пул процессов транскрибации"""
+    global _pool, _pool_key
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+    _pool = None
+    _pool_key = None
+
+
+def transcribe_audio_parallel(audio_path, audio=None, workers=None, chunk_sec=60.0, pcm_cache=None,
+                              cancel_check=None):
+    """Параллельная транскрибация: куски по паузам распознаются в пуле процессов.
+    
+    Каждый воркер держит свою копию модели, поэтому число воркеров
+    ограничено не только ядрами, но и памятью.
+    """
+    if audio is None:
+        audio = decode_audio(audio_path, pcm_cache=pcm_cache)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    chunks = split_at_silence(audio, chunk_sec=chunk_sec)
+    if workers <= 1 or len(chunks) == 1:
+        return transcribe_audio(audio_path, audio=audio, cancel_check=cancel_check)
+    
+    # Пул определяется запрошенным числом воркеров, а не числом кусков файла,
+    # иначе файлы разной длины перезапускали бы воркеры с загрузкой модели
+    pool = _get_pool(ModelManager().get_model_path(), workers)
+    sr = audio.sample_rate
+    # PCM из кэша воркеры читают сами, разделяя страничный кэш ОС
+    shared = isinstance(audio.pcm, np.memmap)
+    futures = [
+        pool.submit(_transcribe_chunk, (audio.pcm.filename, start, end) if shared else audio.pcm_bytes(start, end),
+                    sr, start / sr)
+        for start, end in chunks
+    ]
+    
+    # Склейка в исходном порядке, формат как у transcribe_audio
+    results = []
+    try:
+        for future in futures:
+            while True:
+                if cancel_check:
+                    cancel_check()
+                try:
+                    results.extend(future.result(timeout=0.5))
+                    break
+                except TimeoutError:
+                    continue
+    except BaseException:
+        # При отмене или ошибке еще не начатые куски снимаются с пула
+        for future in futures:
+            future.cancel()
+        raise
+    return results
+
+
+def transcribe_audio(audio_path, audio=None, workers=1, chunk_sec=60.0, pcm_cache=None, cancel_check=None):
+    """Транскрибирует аудиофайл (audio - уже декодированный DecodedAudio).
+    
+    При workers > 1 используется параллельная транскрибация по кускам.
+    С pcm_cache PCM читается из кэша через mmap, без него и без audio
+    файл декодируется потоково, блоками прямо в распознаватель.
+    cancel_check - вызывается между блоками и выбрасывает исключение при отмене.
+    """
+    if workers is None or workers > 1:
+        return transcribe_audio_parallel(audio_path, audio=audio, workers=workers, chunk_sec=chunk_sec,
+                                         pcm_cache=pcm_cache, cancel_check=cancel_check)
+    
+    if audio is None and pcm_cache is not None:
+        audio = decode_audio(audio_path, pcm_cache=pcm_cache)
+    
+    # Распознаватель берется из пула общей модели; PCM подается блоками напрямую, без WAV в памяти
+    results = []
+    with ModelManager().recognizer(SAMPLE_RATE) as rec:
+        for data in stream_pcm_blocks(audio if audio is not None else audio_path):
+            if cancel_check:
+                cancel_check()
+            if rec.AcceptWaveform(data):
+                results.append(json.loads(rec.Result()))
+        
+        results.append(json.loads(rec.FinalResult()))
+    
     return results
 
 
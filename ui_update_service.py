@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+
+
+class UiUpdateThrottler:
+    """Передача обновлений из рабочих потоков в поток Tk пачками с ограничением частоты кадров.
+    
+    Рабочие потоки вызывают post(key, value) и не трогают виджеты. Раз в кадр
+    поток Tk забирает все накопленное и вызывает обработчики в порядке регистрации.
+    Для ключей с coalesce=True доставляется только последнее значение за кадр.
+    """
+    
+    def __init__(self, widget, fps=10):
+        """Инициализация (widget - любой виджет окна, через него планируется after)"""
+        self.widget = widget
+        self.fps = fps
+        self._handlers = OrderedDict()  # key -> (handler, coalesce)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._after_id = None
+    
+    def register(self, key, handler, coalesce=True):
+        """Обработчик для ключа: handler(value) или handler(список значений), если coalesce=False"""
+        self._handlers[key] = (handler, coalesce)
+    
+    def post(self, key, value):
+        """Поставить обновление (можно из любого потока)"""
+        _, coalesce = self._handlers[key]
+        with self._lock:
+            if coalesce:
+                self._pending[key] = value
+            else:
+                self._pending.setdefault(key, []).append(value)
+    
+    def discard(self, key):
+        """Отменить еще не доставленное обновление"""
+        with self._lock:
+            self._pending.pop(key, None)
+    
+    def start(self):
+        """Запустить цикл доставки"""
+        if self._after_id is None:
+            self._schedule()
+    
+    def stop(self):
+        """Остановить цикл доставки (накопленное отбрасывается)"""
+        if self._after_id is not None:
+            try:
+                self.widget.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+        with self._lock:
+            self._pending = {}
+    
+    def _schedule(self):
+        self._after_id = self.widget.after(max(1, int(1000 / self.fps)), self._flush)
+    
+    def flush(self):
+        """Доставить накопленные обновления сразу (только из потока Tk)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        
+        for key, (handler, _) in self._handlers.items():
+            if key in pending:
+                try:
+                    handler(pending[key])
+                except Exception as e:
+                    print(f"Ошибка обновления интерфейса: {e}")
+    
+    def _flush(self):
+        self.flush()
+        self._schedule()
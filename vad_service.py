@@ -0,0 +1,115 @@
+import threading
+from array import array
+import numpy as np
+
+
+class VoiceActivityDetector:
+    """Определение речи и тишины по кускам PCM int16 (энергия с гистерезисом, опционально спектральный поток)"""
+    
+    def __init__(self, sample_rate=16000, start_threshold=500, stop_threshold=350, hangover_sec=0.3,
+                 use_spectral_flux=False, flux_threshold=0.15):
+        """Инициализация детектора
+        
+        start_threshold / stop_threshold - RMS (в единицах int16) для начала и конца речи,
+        hangover_sec - сколько речь удерживается после падения энергии ниже stop_threshold,
+        use_spectral_flux - начало речи дополнительно требует изменения спектра
+        (отсекает стационарный шум: гул, вентилятор).
+        """
+        self.sample_rate = sample_rate
+        self.start_threshold = start_threshold
+        self.stop_threshold = stop_threshold
+        self.hangover_sec = hangover_sec
+        self.use_spectral_flux = use_spectral_flux
+        self.flux_threshold = flux_threshold
+        
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """Сбросить состояние перед новой записью"""
+        with self._lock:
+            self.is_speech = False
+            self.last_rms = 0.0
+            self.frame_samples = array("I")  # Длина каждого фрейма в отсчетах
+            self.decisions = bytearray()  # 1 - речь, 0 - тишина для каждого фрейма
+            self._hangover_left = 0.0
+            self._prev_spectrum = None
+    
+    def add_listener(self, callback):
+        """Подписаться на решения по фреймам: callback(is_speech, rms)"""
+        self._listeners.append(callback)
+    
+    def process(self, data):
+        """Обработать фрейм PCM (bytes) и вернуть True, если это речь"""
+        # frombuffer не копирует данные
+        samples = np.frombuffer(data, dtype=np.int16)
+        if len(samples) == 0:
+            return self.is_speech
+        
+        energy = np.einsum("i,i->", samples, samples, dtype=np.float64)
+        rms = float(np.sqrt(energy / len(samples)))
+        frame_sec = len(samples) / self.sample_rate
+        
+        if self.is_speech:
+            if rms >= self.stop_threshold:
+                self._hangover_left = self.hangover_sec
+                is_speech = True
+            else:
+                self._hangover_left -= frame_sec
+                is_speech = self._hangover_left > 0
+        else:
+            is_speech = rms >= self.start_threshold
+            if is_speech and self.use_spectral_flux:
+                is_speech = self._spectral_flux(samples) >= self.flux_threshold
+            if is_speech:
+                self._hangover_left = self.hangover_sec
+        
+        if self.use_spectral_flux and not is_speech:
+            # Поддерживаем опорный спектр тишины актуальным
+            self._spectral_flux(samples)
+        
+        with self._lock:
+            self.is_speech = is_speech
+            self.last_rms = rms
+            self.decisions.append(1 if is_speech else 0)
+            self.frame_samples.append(len(samples))
+        
+        for callback in self._listeners:
+            callback(is_speech, rms)
+        return is_speech
+    
+    def _spectral_flux(self, samples):
+        """Положительный спектральный поток относительно предыдущего фрейма (0..1)"""
+        spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+        spectrum /= np.sum(spectrum) + 1e-10
+        prev = self._prev_spectrum
+        self._prev_spectrum = spectrum
+        if prev is None or len(prev) != len(spectrum):
+            return 1.0
+        return float(np.sum(np.maximum(spectrum - prev, 0)))
+    
+    def speech_mask(self):
+        """Решения по всем фреймам в виде массива bool"""
+        with self._lock:
+            return np.frombuffer(bytes(self.decisions), dtype=np.uint8).astype(bool)
+    
+    def speech_segments(self):
+        """Интервалы речи (start_sec, end_sec) по решениям фреймов"""
+        with self._lock:
+            decisions = bytes(self.decisions)
+            frame_samples = self.frame_samples.tolist()
+        
+        segments = []
+        position = 0
+        start = None
+        for is_speech, n_samples in zip(decisions, frame_samples):
+            if is_speech and start is None:
+                start = position
+            elif not is_speech and start is not None:
+                segments.append((start / self.sample_rate, position / self.sample_rate))
+                start = None
+            position += n_samples
+        if start is not None:
+            segments.append((start / self.sample_rate, position / self.sample_rate))
+        return segments
@@ -0,0 +1,65 @@
+import wave
+import queue
+import threading
+import time
+
+
+class StreamingWavWriter:
+    """Потоковая запись WAV на диск из фонового потока через ограниченную очередь"""
+    
+    def __init__(self, path, sample_rate=16000, channels=1, sample_width=2, queue_size=256,
+                 header_interval_sec=5.0):
+        """Инициализация и запуск потока записи
+        
+        queue_size - максимум кусков в очереди (при переполнении write ждет),
+        header_interval_sec - как часто заголовок WAV обновляется на диске,
+        чтобы при сбое файл оставался читаемым.
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.header_interval_sec = header_interval_sec
+        self.frames_written = 0
+        self.error = None
+        
+        self._file = open(path, 'wb')
+        self._wf = wave.open(self._file, 'wb')
+        self._wf.setnchannels(channels)
+        self._wf.setsampwidth(sample_width)
+        self._wf.setframerate(sample_rate)
+        
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def write(self, data):
+        """Поставить кусок PCM в очередь на запись"""
+        self._queue.put(data)
+    
+    def _run(self):
+        """Цикл записи (выполняется в отдельном потоке)"""
+        last_patch = time.time()
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            try:
+                self._wf.writeframesraw(data)
+                self.frames_written += len(data) // (self.sample_width * self.channels)
+                
+                if time.time() - last_patch > self.header_interval_sec:
+                    # writeframes обновляет размеры в заголовке
+                    self._wf.writeframes(b'')
+                    self._file.flush()
+                    last_patch = time.time()
+            except Exception as e:
+                self.error = e
+                print(f"Ошибка записи файла: {e}")
+    
+    def close(self):
+        """Дописать очередь, обновить заголовок и закрыть файл"""
+        self._queue.put(None)
+        self._thread.join()
+        self._wf.close()
+        self._file.close()